@@ -0,0 +1,350 @@
+""" Benchmark dei moduli di perturbazione, delle superpipeline e dell'estrazione e generazione del dataset.
+
+Non serve la rete: i testi sono generati in modo deterministico a partire dalle parole di `creazione_dataset/samples.json`.
+I risultati sono salvati in json e possono essere confrontati con quelli di un'esecuzione precedente:
+    python benchmark.py run [--output results.json] [--only modules superpipelines batch extraction generation] [--scales 1000 10000] [--repeat 3]
+    python benchmark.py compare baseline.json results.json [--tolerance 0.1]
+
+`compare` termina con errore se almeno una misura è peggiorata più della tolleranza.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from random import Random
+
+# Le barre di avanzamento falserebbero le misure
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+sys.path.insert(0, "../utils/")
+sys.path.insert(0, "../perturbazione/")
+sys.path.insert(0, "../creazione_dataset/")
+from utils import set_seed
+from pipeline import SplitModuleGenerator, AddPunctuationModule, MergeWordHyphenModule, SplitWithCommaModule, CharsSubModule, TokenSubModule
+from pipeline import TokenizerModule, DetokenizerModule, SuperPipelineGroup
+from perturbation_superpipelines import sup_pipelines, error_matrix, alternatives_cache
+from sample_extraction import Sample_Extractor
+from dataset_generator import Dataset_Generator
+
+SAMPLES_FILE = "../creazione_dataset/samples.json"
+GROUPS = ["modules", "superpipelines", "batch", "extraction", "generation"]
+
+
+class Corpus:
+    """ Generatore deterministico di testo sintetico, con le parole e la punteggiatura dei sample reali """
+    def __init__(self, filename: str = SAMPLES_FILE, seed: int = 0) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            filename(`str`): file json dei sample da cui prendere le parole
+            seed(`int`): seed del generatore
+        """
+        with open(filename) as f:
+            self.words = [w for s in json.load(f) for w in s["text"].split()]
+        self.random = Random(seed)
+
+    def text(self, length: int) -> str:
+        """ Ritorna un testo di almeno `length` caratteri """
+        words = []
+        size = 0
+        while size < length:
+            start = self.random.randrange(len(self.words))
+            chunk = self.words[start:start + self.random.randint(5, 30)]
+            words.extend(chunk)
+            size += sum(len(w) + 1 for w in chunk)
+        return " ".join(words)
+
+    def sentences(self, n: int, paragraphs_per_doc: int = 10) -> dict:
+        """ Ritorna `n` paragrafi, nel formato prodotto da `Sentences_Extractor`. Circa un paragrafo su cinque è più lungo di 100 caratteri e va diviso """
+        sentences = {}
+        for i in range(n):
+            docnum, parId = divmod(i, paragraphs_per_doc)
+            length = self.random.choice([60, 60, 80, 80, 250])
+            sentences.setdefault(docnum, []).append({
+                "text": self.text(length),
+                "docnum": docnum,
+                "parId": parId,
+                "parPos": 0
+            })
+        return sentences
+
+    def samples(self, n: int, paragraphs_per_doc: int = 10) -> list:
+        """ Ritorna `n` sample da 50-100 caratteri, nel formato prodotto da `Sample_Extractor` """
+        return [{
+            "text": self.text(self.random.randint(50, 90))[:100],
+            "docnum": i // paragraphs_per_doc,
+            "parId": i % paragraphs_per_doc,
+            "parPos": 0
+        } for i in range(n)]
+
+
+def cold_alternatives() -> None:
+    """ Svuota la cache delle alternative, in memoria e nella directory temporanea in cui la salvano i benchmark (vedi `run`), così ogni esecuzione parte a freddo """
+    folder = os.environ.get("ALTERNATIVES_CACHE_DIR")
+    if folder:
+        for filename in os.listdir(folder):
+            os.remove(os.path.join(folder, filename))
+    if alternatives_cache.cache_info().currsize:
+        alternatives_cache().clear()
+
+
+def measure(function, size: int, unit: str, repeat: int) -> dict:
+    """ Esegue `function` `repeat` volte e ritorna la misura migliore, come quantità elaborate al secondo.
+    Ogni esecuzione parte con la cache delle alternative vuota
+
+    Args:
+        function: funzione da misurare, senza argomenti
+        size(`int`): quantità (token, caratteri, sample) elaborata da una chiamata di `function`
+        unit(`str`): unità di misura della quantità
+        repeat(`int`): numero di esecuzioni
+    """
+    best = None
+    for _ in range(repeat):
+        cold_alternatives()
+        set_seed(0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "value": size / best,
+        "unit": f"{unit}/s",
+        "seconds": best,
+        "size": size
+    }
+
+
+def module_factories() -> dict:
+    """ Un modulo per ogni funzione "factory" di pipeline.py, con probabilità 1 così che ogni token sia perturbato.
+    Il modulo di sostituzione token usa la cache delle alternative delle superpipeline, svuotata prima di ogni esecuzione """
+    matrix = error_matrix()
+    return {
+        "SplitModuleGenerator": lambda: SplitModuleGenerator(1),
+        "AddPunctuationModule": lambda: AddPunctuationModule(1, "."),
+        "MergeWordHyphenModule": lambda: MergeWordHyphenModule(1),
+        "SplitWithCommaModule": lambda: SplitWithCommaModule(1, ","),
+        "CharsSubModule": lambda: CharsSubModule(matrix, 1),
+        "TokenSubModule":
+        lambda: TokenSubModule(matrix, 5, alternatives_cache(), 1)
+    }
+
+
+def bench_modules(corpus: Corpus, args) -> dict:
+    """ Token al secondo di ogni modulo di perturbazione, del tokenizzatore e del detokenizzatore """
+    texts = [corpus.text(800) for _ in range(args.texts)]
+    tokenizer = TokenizerModule()
+    detokenizer = DetokenizerModule()
+    tokenized = [tokenizer.apply(t) for t in texts]
+    n_tokens = sum(len(t) for t in tokenized)
+    results = {}
+    for name, factory in module_factories().items():
+        module = factory()
+        results[f"modules/{name}"] = measure(
+            lambda: [module.apply(t) for t in tokenized], n_tokens, "token",
+            args.repeat)
+    results["modules/TokenizerModule"] = measure(
+        lambda: [tokenizer.apply(t) for t in texts], n_tokens, "token",
+        args.repeat)
+    results["modules/DetokenizerModule"] = measure(
+        lambda: detokenizer.apply_many(tokenized), n_tokens, "token",
+        args.repeat)
+    return results
+
+
+def bench_superpipelines(corpus: Corpus, args) -> dict:
+    """ Caratteri al secondo di ognuna delle superpipeline di perturbation_superpipelines.py """
+    texts = [corpus.text(2000) for _ in range(args.texts)]
+    n_chars = sum(len(t) for t in texts)
+    results = {}
+    for name, sup in sup_pipelines.items():
+        results[f"superpipelines/{name}"] = measure(
+            lambda: [sup.run(t) for t in texts], n_chars, "char", args.repeat)
+    return results
+
+
+def bench_batch(corpus: Corpus, args) -> dict:
+    """ Sample al secondo perturbati da ogni superpipeline e da tutte insieme, un sample alla volta (`run`) e in un unico lotto (`run_batch`) """
+    texts = [s["text"] for s in corpus.samples(args.texts * 20)]
+    group = SuperPipelineGroup(sup_pipelines)
+    results = {}
+    for name, sup in [*sup_pipelines.items(), ("SuperPipelineGroup", group)]:
+        results[f"batch/{name}/run"] = measure(
+            lambda: [sup.run(t) for t in texts], len(texts), "sample",
+            args.repeat)
+        results[f"batch/{name}/run_batch"] = measure(
+            lambda: sup.run_batch(texts), len(texts), "sample", args.repeat)
+    return results
+
+
+def bench_extraction(corpus: Corpus, args) -> dict:
+    """ Paragrafi al secondo elaborati da `Sample_Extractor.extract`, per ogni scala """
+    results = {}
+    for scale in args.scales:
+        sentences = corpus.sentences(scale)
+
+        def extract():
+            Sample_Extractor(sentences, 50, 100).extract()
+
+        results[f"extraction/Sample_Extractor/{scale}"] = measure(
+            extract, scale, "paragraph", args.repeat)
+    return results
+
+
+def bench_generation(corpus: Corpus, args) -> dict:
+    """ Sample al secondo perturbati da `Dataset_Generator.perturb_samples` con tutte le superpipeline, per ogni scala """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for scale in args.scales:
+            filename = os.path.join(folder, f"samples_{scale}.json")
+            with open(filename, "w") as f:
+                json.dump(corpus.samples(scale), f)
+
+            def generate():
+                Dataset_Generator(filename).perturb_samples(
+                    filter_paragraphs=False, workers=args.workers)
+
+            results[f"generation/Dataset_Generator/{scale}"] = measure(
+                generate, scale, "sample", args.repeat)
+    return results
+
+
+BENCHMARKS = {
+    "modules": bench_modules,
+    "superpipelines": bench_superpipelines,
+    "batch": bench_batch,
+    "extraction": bench_extraction,
+    "generation": bench_generation
+}
+
+
+def git_commit() -> str:
+    """ Ritorna il commit corrente, oppure None fuori da un repository git """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> None:
+    corpus = Corpus(seed=args.seed)
+    results = {}
+    # La cache delle alternative (anche quella dei processi di generazione) è salvata in una
+    # directory temporanea: la cartella perturbazione non è toccata e non rende più veloci le misure
+    with tempfile.TemporaryDirectory() as folder:
+        os.environ["ALTERNATIVES_CACHE_DIR"] = folder
+        for group in args.only:
+            print(f"Benchmark {group}...", file=sys.stderr)
+            group_results = BENCHMARKS[group](corpus, args)
+            for name, result in group_results.items():
+                print(f"  {name}: {result['value']:,.0f} {result['unit']}",
+                      file=sys.stderr)
+            results.update(group_results)
+    output = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v
+                     for k, v in vars(args).items() if k != "function"}
+        },
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float) -> list:
+    """ Confronta due esecuzioni. Ritorna una riga (nome, valore di base, valore corrente, rapporto, peggiorato) per ogni misura presente in entrambe
+
+    Args:
+        baseline(`dict`): risultati di riferimento
+        current(`dict`): risultati da confrontare
+        tolerance(`float`): peggioramento relativo tollerato (0.1 = 10%)
+    """
+    rows = []
+    for name, base in baseline.items():
+        if name not in current:
+            continue
+        ratio = current[name]["value"] / base["value"]
+        rows.append((name, base["value"], current[name]["value"], ratio,
+                     ratio < 1 - tolerance))
+    return rows
+
+
+def compare(args) -> None:
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+    rows = compare_results(baseline, current, args.tolerance)
+    width = max((len(r[0]) for r in rows), default=0)
+    for name, base, value, ratio, regression in rows:
+        flag = "REGRESSIONE" if regression else ""
+        print(f"{name:<{width}}  {base:>14,.0f}  {value:>14,.0f}  "
+              f"{ratio:6.2f}x  {flag}")
+    for name in sorted(set(baseline) ^ set(current)):
+        where = "base" if name in baseline else "corrente"
+        print(f"{name:<{width}}  presente solo nell'esecuzione {where}")
+    regressions = [r[0] for r in rows if r[4]]
+    if regressions:
+        print(f"\n{len(regressions)} misure peggiorate più del "
+              f"{args.tolerance:.0%}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark della perturbazione e della creazione del dataset")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="esegue i benchmark")
+    run_parser.add_argument("--output", default="results.json")
+    run_parser.add_argument("--only",
+                            nargs="+",
+                            choices=GROUPS,
+                            default=GROUPS,
+                            help="gruppi di benchmark da eseguire")
+    run_parser.add_argument(
+        "--scales",
+        nargs="+",
+        type=int,
+        default=[1000, 10000],
+        help="numero di sample per l'estrazione e la generazione")
+    run_parser.add_argument(
+        "--texts",
+        type=int,
+        default=50,
+        help="numero di testi per i moduli e le superpipeline")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.set_defaults(function=run)
+
+    compare_parser = commands.add_parser(
+        "compare", help="confronta i risultati con quelli di base")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance",
+                                type=float,
+                                default=0.1,
+                                help="peggioramento relativo tollerato")
+    compare_parser.set_defaults(function=compare)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
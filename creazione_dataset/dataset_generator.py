@@ -1,27 +1,214 @@
 from tqdm import tqdm
 import json
 import sys
-import nltk
-from random import shuffle
+from functools import lru_cache, partial
+from itertools import islice, tee
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+from random import Random
 
+sys.path.insert(0, "../utils/")
 sys.path.insert(0, "../perturbazione/")
-from perturbation_superpipelines import sup_pipelines
+from perturbation_superpipelines import sup_pipelines, save_alternatives
+from pipeline import SuperPipelineGroup
+import instrumentation
+from instrumentation import Profiler
+from utils import derive_seed
+from sample_store import SampleStore
 
-nltk.download('punkt')
+
+@lru_cache(maxsize=None)
+def superpipeline_group(pipelines: tuple = None) -> SuperPipelineGroup:
+    """ Gruppo delle superpipeline `pipelines` (tutte se None). Le superpipeline sono costruite al primo utilizzo """
+    return SuperPipelineGroup(sup_pipelines.select(pipelines))
+
+
+def sample_seed(sample: dict, sup_name: str, seed: int = 0) -> int:
+    """ Seed con cui è perturbato un sample da una superpipeline. Dipende solo dal sample, dalla superpipeline e dal seed di base
+
+    Args:
+        sample(`dict`): il sample da perturbare
+        sup_name(`str`): nome della superpipeline
+        seed(`int`): seed di base della generazione
+    """
+    return derive_seed(seed, sample["docnum"], sample["parId"],
+                       sample["parPos"], sup_name)
+
+
+def perturbations(sample: dict,
+                  seed: int = 0,
+                  pipelines: tuple = None) -> dict:
+    """ Perturba il testo di un sample con le superpipeline, ognuna con il proprio seed. Ritorna un dizionario che associa ad ogni nome di superpipeline il testo perturbato.
+    Il testo è diviso e tokenizzato una volta sola per tutte le superpipeline
+
+    Args:
+        sample(`dict`): il sample da perturbare
+        seed(`int`): seed di base della generazione
+        pipelines(`tuple(str)`): nomi delle superpipeline da usare. Di default sono usate tutte
+    """
+    group = superpipeline_group(pipelines)
+    seeds = {
+        sup_name: sample_seed(sample, sup_name, seed)
+        for sup_name in group.superpipelines
+    }
+    return group.run(sample["text"], seeds)
+
+
+def perturb_sample(sample: dict,
+                   seed: int = 0,
+                   pipelines: tuple = None) -> dict:
+    """ Perturba un sample con le superpipeline, ognuna con il proprio seed. Restituisce il nuovo sample
+
+    Args:
+        sample(`dict`): il sample da perturbare
+        seed(`int`): seed di base della generazione
+        pipelines(`tuple(str)`): nomi delle superpipeline da usare. Di default sono usate tutte
+    """
+    perturbed = perturbations(sample, seed, pipelines)
+    return {**sample, "perturbed": {**sample["perturbed"], **perturbed}}
+
+
+def perturbations_profiled(sample: dict,
+                           seed: int = 0,
+                           pipelines: tuple = None) -> tuple:
+    """ Come `perturbations`, con la strumentazione attiva. Ritorna i testi perturbati e le statistiche raccolte (vedi perturbazione/instrumentation.py) """
+    profiler = Profiler()
+    with instrumentation.enabled(profiler):
+        perturbed = perturbations(sample, seed, pipelines)
+    return perturbed, profiler.stats
+
+
+def iter_perturbations(samples,
+                       workers: int = 1,
+                       seed: int = 0,
+                       pipelines: tuple = None,
+                       profiler: Profiler = None):
+    """ Perturba, mantenendo l'ordine, i sample di un iterabile e ne ritorna i testi perturbati (vedi `perturbations`). Con più `workers` i sample sono letti a blocchi, così non viene mai consumato tutto l'input in anticipo
+
+    Args:
+        samples: iterabile di sample da perturbare
+        workers(`int`): numero di processi usati per la perturbazione
+        seed(`int`): seed di base della generazione
+        pipelines(`tuple(str)`): nomi delle superpipeline da usare. Di default sono usate tutte
+        profiler(`Profiler`): se impostato, vi sono sommate le statistiche della perturbazione di ogni sample, anche di quelli perturbati da altri processi
+    """
+    if profiler is None:
+        yield from map_samples(
+            partial(perturbations, seed=seed, pipelines=pipelines), samples,
+            workers)
+        return
+    for perturbed, stats in map_samples(
+            partial(perturbations_profiled, seed=seed, pipelines=pipelines),
+            samples, workers):
+        profiler.merge(stats)
+        yield perturbed
+
+
+def iter_perturbed(samples,
+                   workers: int = 1,
+                   seed: int = 0,
+                   pipelines: tuple = None,
+                   profiler: Profiler = None):
+    """ Come `iter_perturbations`, ma ritorna i sample completi, con i testi perturbati aggiunti al campo `perturbed` """
+    samples, originals = tee(samples)
+    for perturbed, sample in zip(
+            iter_perturbations(samples, workers, seed, pipelines, profiler),
+            originals):
+        yield {**sample, "perturbed": {**sample["perturbed"], **perturbed}}
+
+
+def init_worker() -> None:
+    """ Inizializza un processo di `map_samples`: quando il processo termina, la cache delle alternative che ha riempito viene unita a quella salvata su disco """
+    Finalize(None, save_alternatives, exitpriority=10)
+
+
+def map_samples(function, samples, workers: int = 1):
+    """ Applica `function` ai sample, in ordine, con `workers` processi.
+    Alla fine i processi sono chiusi (e non terminati), così ognuno salva la propria cache delle alternative """
+    if workers <= 1:
+        yield from map(function, samples)
+        return
+    samples = iter(samples)
+    pool = Pool(workers, initializer=init_worker)
+    try:
+        while True:
+            batch = list(islice(samples, workers * 256))
+            if not batch:
+                return
+            yield from pool.imap(function, batch, 16)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def read_jsonl(filename: str):
+    """ Legge un file JSONL (un oggetto json per riga) un sample alla volta """
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def selected_samples(filename: str,
+                     reducedDimension: int = None,
+                     filter_paragraphs: bool = True):
+    """ Generatore dei sample di un file JSONL da perturbare, letti uno alla volta e con il campo `perturbed` vuoto
+
+    Args:
+        filename(`str`): file JSONL dei sample
+        reducedDimension(`int`): se impostato, indica quanti sample tenere
+        filter_paragraphs(`bool`): se True, sono scartati i sample del primo e dell'ultimo paragrafo di ogni documento (il file è letto due volte)
+    """
+    samples = read_jsonl(filename)
+    if filter_paragraphs:
+        print("Filtrando primi e ultimi paragrafi")
+        maxes = last_paragraphs(read_jsonl(filename))
+        samples = (s for s in samples if is_inner_paragraph(s, maxes))
+    for s in islice(samples, reducedDimension or None):
+        yield {**s, "perturbed": {}}
+
+
+def last_paragraphs(samples) -> dict:
+    """ Ritorna un dizionario che associa ad ogni documento l'id del suo ultimo paragrafo """
+    return last_paragraph_ids((s["docnum"], s["parId"]) for s in samples)
+
+
+def last_paragraph_ids(pairs) -> dict:
+    """ Come `last_paragraphs`, a partire dalle coppie (docnum, parId) dei sample """
+    maxes = {}
+    for docnum, parId in pairs:
+        if parId > maxes.get(docnum, -1):
+            maxes[docnum] = parId
+    return maxes
+
+
+def is_inner_paragraph(fragment: dict, maxes: dict) -> bool:
+    """ Ritorna True se il sample non appartiene né al primo né all'ultimo paragrafo del suo documento """
+    return is_inner(fragment["docnum"], fragment["parId"], maxes)
+
+
+def is_inner(docnum: int, parId: int, maxes: dict) -> bool:
+    """ Come `is_inner_paragraph`, dati il documento e il paragrafo del sample """
+    return not (parId == 0 or parId == maxes[docnum])
 
 
 class Dataset_Generator:
     """ Classe che si occupa di creare un dataset con vari livelli di perturbazione a partire da un lista di sample """
-    def __init__(self, datset_filename: str) -> None:
+    def __init__(self, datset_filename: str, streaming: bool = False) -> None:
         """ Costruttore base della classe
         
         Args:
             dataset_filename(`str`): nome del file in cui si trovano i samples
+            streaming(`bool`): se True, il file è in formato JSONL e non viene caricato in memoria: i sample sono letti e perturbati uno alla volta da `perturb_to_file`
         """
+        self.filename = datset_filename
+        if streaming:
+            self.dataset = None
+            return
         print("Caricando le frasi estratte...")
-        with open(datset_filename) as f:
-            self.dataset = json.load(f)
-        self.dataset = [{**d, "perturbed": {}} for d in self.dataset]
+        # I sample sono tenuti per colonne (vedi sample_store.py), senza i testi perturbati del file
+        self.dataset = SampleStore.from_file(datset_filename,
+                                             keep_perturbed=False)
 
     def filter_paragraphs(self) -> None:
         """ Funzione che si occupa di filtrare tutti i sample del dataset.
@@ -29,64 +216,96 @@ class Dataset_Generator:
         Tutti i sample in `self.dataset` appartenenti al primo o all'ultimo paragrafo di un documento sono scartati
         """
         print("Filtrando primi e ultimi paragrafi")
-
-        def isFirstParagraph(fragment: dict) -> bool:
-            return fragment["parId"] == 0
-
-        def isLastParagraph(fragment: dict, maxes: dict) -> bool:
-            return fragment["parId"] == maxes[fragment["docnum"]]
-
-        maxes = {}
-        for fragment in self.dataset:
-            if fragment["docnum"] not in maxes:
-                maxes[fragment["docnum"]] = []
-            maxes[fragment["docnum"]].append(fragment["parId"])
-        maxes = {
-            docnum: max(maxList)
-            for docnum, maxList in tqdm(maxes.items())
-        }
-        self.dataset = [
-            f for f in tqdm(self.dataset)
-            if not (isFirstParagraph(f) or isLastParagraph(f, maxes))
-        ]
-
-    def perturbed_sample(self, sample: dict, perturbed: str,
-                         sup_name: str) -> dict:
-        """ Aggiunge una frase perturbata al campo `perturbed` di un sample. Restituisce il nuovo sample
-        
-        Args:
-            sample(`dict`): il sample che è stato perturbato
-            perturbed(`str`): frase già perturbata
-            sup_name(`str`): nome della pipeline di perturbazione utlizzata
-        """
-        return {
-            **sample, "perturbed": {
-                **sample["perturbed"], sup_name: perturbed
-            }
-        }
+        docnums = self.dataset.columns["docnum"]
+        parIds = self.dataset.columns["parId"]
+        maxes = last_paragraph_ids(
+            (docnums[i], parIds[i]) for i in self.dataset.order)
+        self.dataset.filter(lambda i: is_inner(docnums[i], parIds[i], maxes))
 
     def perturb_samples(self,
                         reducedDimension: int = None,
-                        filter_paragraphs: bool = True) -> None:
+                        filter_paragraphs: bool = True,
+                        workers: int = 1,
+                        seed: int = 0,
+                        pipelines: list = None,
+                        profile: str = None) -> None:
         """ Funzione che si occupa del processo di perturbazione del dataset 
         
         Args:
             reducedDimension(`int`): se si vuole perturbare e tenere solo un certo numero di sample, questo parametro indica il numero di sample da tenere
             filter_paragraphs(`bool`): se False, la fase di filraggio degli ultimi paragrafi non viene applicata. Di default è True.            
+            workers(`int`): numero di processi usati per la perturbazione. Di default è 1
+            seed(`int`): seed di base. Ogni sample è perturbato con un seed derivato da questo, quindi il risultato non dipende dal numero di `workers`
+            pipelines(`list(str)`): nomi delle superpipeline da usare (ad esempio ["S1", "T1"]). Di default sono usate tutte
+            profile(`str`): se impostato, la perturbazione è strumentata e alla fine le statistiche per superpipeline (tempi, token e gruppi perturbati per modulo, pipeline scelte per blocco) sono salvate in json in questo file
         """
+        pipelines = tuple(pipelines) if pipelines else None
+        profiler = Profiler() if profile else None
         reducedDimension = reducedDimension if reducedDimension and reducedDimension < len(
             self.dataset) else len(self.dataset)
-        i = 0
         if filter_paragraphs:
             self.filter_paragraphs()
-        for sup_name, sup in sup_pipelines.items():
-            desc = f"Perturbando con {sup_name} ({i}/{len(sup_pipelines)})"
-            i += 1
-            self.dataset = [
-                self.perturbed_sample(s, sup.run(s["text"]), sup_name)
-                for s in tqdm(self.dataset[:reducedDimension], desc=desc)
-            ]
-        shuffle(self.dataset)
+        store = self.dataset
+        store.truncate(reducedDimension)
+        desc = f"Perturbando con {len(pipelines or sup_pipelines)} superpipeline"
+        perturbed = iter_perturbations((store.row(i) for i in store.order),
+                                       workers, seed, pipelines, profiler)
+        for index, texts in zip(store.order,
+                                tqdm(perturbed, total=len(store),
+                                     desc=desc)):
+            store.set_perturbed(index, texts)
+        save_alternatives()
+        if profiler:
+            profiler.dump(profile)
+        store.shuffle(Random(seed))
+
+    def perturb_to_file(self,
+                        filename: str,
+                        reducedDimension: int = None,
+                        filter_paragraphs: bool = True,
+                        reduced_filename: str = None,
+                        reduced_size: int = None,
+                        workers: int = 1,
+                        seed: int = 0,
+                        pipelines: list = None,
+                        profile: str = None) -> None:
+        """ Versione in streaming di `perturb_samples` e `saveToFile`, da usare con `streaming=True`.
+        I sample sono letti dal file JSONL, perturbati e scritti su `filename` (in JSONL) uno alla volta, quindi la memoria usata non dipende dalla dimensione del dataset.
+        A differenza di `perturb_samples`, i sample non sono mescolati
+        
+        Args:
+            filename(`str`): nome del file JSONL in cui salvare il dataset
+            reducedDimension(`int`): se impostato, indica quanti sample perturbare
+            filter_paragraphs(`bool`): se False, la fase di filraggio degli ultimi paragrafi non viene applicata. Di default è True.
+            reduced_filename(`str`): se impostato, nome del file JSONL in cui salvare anche i primi `reduced_size` sample, nella stessa passata
+            reduced_size(`int`): numero di sample da salvare in `reduced_filename`
+            workers(`int`): numero di processi usati per la perturbazione
+            seed(`int`): seed di base della generazione
+            pipelines(`list(str)`): nomi delle superpipeline da usare. Di default sono usate tutte
+            profile(`str`): se impostato, file json in cui salvare le statistiche della perturbazione (vedi `perturb_samples`)
+        """
+        pipelines = tuple(pipelines) if pipelines else None
+        profiler = Profiler() if profile else None
+        samples = selected_samples(self.filename, reducedDimension,
+                                   filter_paragraphs)
+        print(f"Salvando le frasi con perturbazioni in {filename}...")
+        reduced_file = open(reduced_filename, "w") if reduced_filename else None
+        try:
+            with open(filename, "w") as f:
+                for i, sample in enumerate(
+                        tqdm(iter_perturbed(samples, workers, seed,
+                                            pipelines, profiler))):
+                    line = json.dumps(sample) + "\n"
+                    f.write(line)
+                    if reduced_file and (reduced_size is None
+                                         or i < reduced_size):
+                        reduced_file.write(line)
+        finally:
+            if reduced_file:
+                reduced_file.close()
+        save_alternatives()
+        if profiler:
+            profiler.dump(profile)
 
     def saveToFile(self, filename: str, reducedDimension: int = None):
         """ Salva su file json il dataset perturbato. Prima di eseguirlo è necessario eseguire il metodo `perturb_dataset` 
@@ -101,7 +320,7 @@ class Dataset_Generator:
             f"Salvando {reducedDimension} frasi con perturbazioni in {filename}..."
         )
         with open(filename, "w") as f:
-            json.dump(self.dataset[:reducedDimension], f, indent=2)
+            self.dataset.dump(f, reducedDimension)
 
 
 def main():
@@ -0,0 +1,87 @@
+import json
+import os
+
+
+class DocumentManifest:
+    """ Indice dei documenti del dataset vaticano: per ogni documento la lingua, il numero di paragrafi e la dimensione del file.
+    È salvato accanto alla directory del dataset e permette a `Sentences_Extractor` di aprire solo i file nelle lingue richieste.
+    La voce di un documento è valida finché la data di modifica e la dimensione del suo file non cambiano """
+    VERSION = 1
+
+    def __init__(self, filename: str) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            filename(`str`): file in cui è salvato l'indice. Se esiste già, l'indice viene caricato da questo file
+        """
+        self.filename = filename
+        self.entries = {}
+        self.changed = False
+        if os.path.exists(filename):
+            self.load()
+
+    @classmethod
+    def for_folder(cls, dataset_folder: str) -> "DocumentManifest":
+        """ Indice della directory `dataset_folder`, salvato nel file `<dataset_folder>.manifest.json` """
+        return cls(dataset_folder.rstrip("/") + ".manifest.json")
+
+    def load(self) -> None:
+        """ Carica l'indice dal file. Un indice illeggibile o scritto con un'altra versione del formato è ignorato """
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except ValueError:
+            return
+        if data.get("version") == self.VERSION:
+            self.entries = data["documents"]
+
+    def lookup(self, docnum: int, stat: os.stat_result) -> dict:
+        """ Ritorna la voce del documento `docnum`, oppure None se manca o se il file è cambiato
+
+        Args:
+            docnum(`int`): numero del documento
+            stat(`os.stat_result`): stato attuale del file del documento
+        """
+        entry = self.entries.get(str(docnum))
+        if entry is None or entry["mtime_ns"] != stat.st_mtime_ns or entry[
+                "size"] != stat.st_size:
+            return None
+        return entry
+
+    def update(self, docnum: int, stat: os.stat_result, language: str,
+               paragraphs: int) -> None:
+        """ Aggiorna la voce del documento `docnum`, letto quando il suo file aveva lo stato `stat` """
+        entry = {
+            "language": language,
+            "paragraphs": paragraphs,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns
+        }
+        if self.entries.get(str(docnum)) != entry:
+            self.entries[str(docnum)] = entry
+            self.changed = True
+
+    def prune(self, docnums) -> None:
+        """ Rimuove le voci dei documenti che non sono in `docnums` (i file cancellati) """
+        keep = {str(d) for d in docnums}
+        removed = [d for d in self.entries if d not in keep]
+        for d in removed:
+            del self.entries[d]
+        self.changed = self.changed or bool(removed)
+
+    def save(self) -> None:
+        """ Salva l'indice, se è cambiato. Se la directory non è scrivibile l'indice non viene salvato """
+        if not self.changed:
+            return
+        try:
+            # Scritto a parte e poi sostituito, per non lasciare un indice a metà
+            with open(self.filename + ".tmp", "w") as f:
+                json.dump({
+                    "version": self.VERSION,
+                    "documents": self.entries
+                }, f)
+            os.replace(self.filename + ".tmp", self.filename)
+        except OSError as e:
+            print(f"Impossibile salvare l'indice {self.filename}: {e}")
+            return
+        self.changed = False
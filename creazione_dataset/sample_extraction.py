@@ -1,10 +1,25 @@
 from re import finditer
 import json
+from bisect import bisect_left, bisect_right
 from itertools import chain
-import sys
 
-sys.path.insert(0, "../utils/")
-from utils import find_all
+SMART_SPLIT_MARKS = "[?!;:]"
+SPACE_SPLIT_MARKS = " "
+
+
+def split_positions(text: str, marks: str) -> list:
+    """ Ritorna la lista ordinata delle posizioni in `text` dei caratteri che corrispondono a `marks` """
+    return [m.start() for m in finditer(marks, text)]
+
+
+def last_split_point(positions: list, offset: int, max_optimal_size: int):
+    """ Dato l'indice `positions` di un testo, ritorna il punto di split (relativo a `offset`) per il resto del testo che inizia in `offset`,
+    oppure None se nessuna posizione cade nei primi `max_optimal_size` caratteri del resto """
+    first = bisect_left(positions, offset)
+    if first == len(positions) or positions[first] >= offset + max_optimal_size:
+        return None
+    last = bisect_right(positions, offset + max_optimal_size) - 1
+    return positions[last] - offset + 1
 
 
 class Sample_Extractor:
@@ -22,7 +37,7 @@ class Sample_Extractor:
         """
         self.sentences = {int(key): value for key, value in sentences.items()}
         self.doc_min = 0
-        self.doc_max = max(sentences.keys())
+        self.doc_max = max(self.sentences.keys(), default=0)
         self.min_len = sentences_min_len
         self.max_len = sentences_max_len
 
@@ -38,19 +53,8 @@ class Sample_Extractor:
             "parPos": sentence["parPos"] + 1
         }
 
-    def spaceSplit(self, sentence, max_optimal_size):
-        """ Strategia di split di fallback """
-        if (len(sentence["text"]) <= max_optimal_size):
-            return sentence, None
-        punktMarks = [" "]
-        splitPoints = [
-            find_all(sentence["text"], punktMark) for punktMark in punktMarks
-        ]
-        splitPoints = list(chain(*splitPoints))
-        if all([x == -1 or x >= max_optimal_size for x in splitPoints]):
-            return self.numSplit(sentence, max_optimal_size)
-        splitPoint = sorted([x for x in splitPoints if x <= max_optimal_size
-                             ])[-1] + 1
+    def cutAt(self, sentence, splitPoint):
+        """ Divide una frase nel punto `splitPoint`, ritornando la prima parte e il resto """
         return {
             **sentence, "text": sentence["text"][:splitPoint]
         }, {
@@ -58,6 +62,17 @@ class Sample_Extractor:
             "parPos": sentence["parPos"] + 1
         }
 
+    def spaceSplit(self, sentence, max_optimal_size):
+        """ Strategia di split di fallback """
+        if (len(sentence["text"]) <= max_optimal_size):
+            return sentence, None
+        splitPoint = last_split_point(
+            split_positions(sentence["text"], SPACE_SPLIT_MARKS), 0,
+            max_optimal_size)
+        if splitPoint is None:
+            return self.fallbackSplit(sentence, max_optimal_size)
+        return self.cutAt(sentence, splitPoint)
+
     def smartSplit(self, sentence, max_optimal_size):
         """ Divide the string into a optimal dataset string and the rest
 
@@ -71,52 +86,89 @@ class Sample_Extractor:
         """
         if (len(sentence["text"]) <= max_optimal_size):
             return sentence, None
-        punktMarks = ["?", "!", ";", ":"]
-        splitPoints = [
-            find_all(sentence["text"], punktMark) for punktMark in punktMarks
-        ]
-        splitPoints = list(chain(*splitPoints))
-        if all([x == -1 or x >= max_optimal_size for x in splitPoints]):
+        splitPoint = last_split_point(
+            split_positions(sentence["text"], SMART_SPLIT_MARKS), 0,
+            max_optimal_size)
+        if splitPoint is None:
             return self.spaceSplit(sentence, max_optimal_size)
-        splitPoint = sorted([x for x in splitPoints if x <= max_optimal_size
-                             ])[-1] + 1
-        return {
-            **sentence, "text": sentence["text"][:splitPoint]
-        }, {
-            **sentence, "text": sentence["text"][splitPoint:],
-            "parPos": sentence["parPos"] + 1
-        }
+        return self.cutAt(sentence, splitPoint)
+
+    def chunk_spans(self, text: str, max_optimal_size: int):
+        """ Generatore delle coppie (inizio, fine) dei pezzi in cui `smartSplit`, applicato ripetutamente, divide `text`.
+        Le posizioni della punteggiatura e degli spazi sono calcolate una volta sola, ogni split è una ricerca binaria
+
+        Args:
+            text(`str`): testo da dividere
+            max_optimal_size(`int`): lunghezza massima di un pezzo
+        """
+        marks = split_positions(text, SMART_SPLIT_MARKS)
+        spaces = None
+        offset = 0
+        while len(text) - offset > max_optimal_size:
+            splitPoint = last_split_point(marks, offset, max_optimal_size)
+            if splitPoint is None:
+                if spaces is None:
+                    spaces = split_positions(text, SPACE_SPLIT_MARKS)
+                splitPoint = last_split_point(spaces, offset,
+                                              max_optimal_size)
+            if splitPoint is None:
+                splitPoint = max_optimal_size
+            yield (offset, offset + splitPoint)
+            offset += splitPoint
+        yield (offset, len(text))
 
     def accettable_length(self, sent: str):
         """ Returns true if the sentece is within the accetable lenght range """
         return self.min_len <= len(sent) <= self.max_len
 
+    def split_paragraph(self, paragraph: dict) -> list:
+        """ Divide un paragrafo in tutti i suoi pezzi con una sola scansione da sinistra a destra. I pezzi non sono filtrati per lunghezza
+
+        Args:
+            paragraph(`dict`): paragrafo da dividere
+        """
+        text = paragraph["text"]
+        return [{
+            **paragraph, "text": text[start:end],
+            "parPos": paragraph["parPos"] + i
+        } for i, (start, end) in enumerate(
+            self.chunk_spans(text, self.max_len))]
+
+    def iter_samples(self, paragraphs=None):
+        """ Generatore dei sample, prodotti un paragrafo alla volta. I sample di un paragrafo sono prodotti nell'ordine in cui compaiono nel testo
+
+        Args:
+            paragraphs: iterabile dei paragrafi da cui estrarre i sample. Di default sono usate le frasi passate al costruttore
+        """
+        if paragraphs is None:
+            paragraphs = chain(*self.sentences.values())
+        for paragraph in paragraphs:
+            for chunk in self.split_paragraph(paragraph):
+                if self.accettable_length(chunk["text"]):
+                    yield chunk
+
     def extract(self) -> None:
         """ Performa l'estrazione dei sample dalle frasi """
         allsentences = list(chain(*self.sentences.values()))
         sent_number = len(allsentences)
-        extracted = [
-            phr for phr in allsentences if self.accettable_length(phr["text"])
-        ]
-
-        allsentences = [
-            phr for phr in allsentences
-            if not self.accettable_length(phr["text"])
-        ]
-
         print(f"Numero totali di frasi nel dataset: {sent_number}")
         print(f"Splittando frasi in sequenze da max {self.max_len} caratteri")
 
-        while len(allsentences) > 0:
-            if len(extracted) % 1000 == 0:
-                print(
-                    f"Frasi da elaborare: {len(allsentences)} -- Frasi Prodotte: {len(extracted)}"
-                )
-            extracted_sent, rest = self.smartSplit(allsentences.pop(0),
-                                                   self.max_len)
-            extracted.append(extracted_sent)
-            if (rest):
-                allsentences.append(rest)
+        extracted = []
+        pending = []
+        for phr in allsentences:
+            if self.accettable_length(phr["text"]):
+                extracted.append(phr)
+            else:
+                pending.append(self.split_paragraph(phr))
+
+        # I pezzi sono aggiunti nello stesso ordine delle versioni precedenti:
+        # prima il primo pezzo di ogni paragrafo, poi il secondo e così via
+        i = 0
+        while pending:
+            extracted.extend(chunks[i] for chunks in pending)
+            i += 1
+            pending = [chunks for chunks in pending if len(chunks) > i]
 
         self.extracted = [
             x for x in extracted if self.accettable_length(x["text"])
@@ -127,6 +179,10 @@ class Sample_Extractor:
         return self.extracted
 
     def saveToFile(self, output_filename: str) -> None:
-        "Salva le frasi estratte su file"
+        "Salva le frasi estratte su file. Se il nome del file termina con `.jsonl` è scritto un sample per riga"
         with open(output_filename, "w") as f:
-            json.dump(self.extracted, f, indent=2)
\ No newline at end of file
+            if output_filename.endswith(".jsonl"):
+                for sample in self.extracted:
+                    f.write(json.dumps(sample) + "\n")
+            else:
+                json.dump(self.extracted, f, indent=2)
\ No newline at end of file
@@ -0,0 +1,203 @@
+import json
+from array import array
+
+# Campi interi dei sample, salvati in array compatti invece che in liste di oggetti
+INT_FIELDS = ("docnum", "parId", "parPos")
+# Valore dei campi che un sample non ha (un campo comparso solo in sample successivi, o mancante)
+MISSING = object()
+# Caratteri che possono continuare un numero json
+NUMBER_CHARS = frozenset(".eE+-0123456789")
+
+
+class SampleStore:
+    """ Raccolta di sample memorizzata per colonne: una colonna per ogni campo dei sample e una colonna di testi per ogni superpipeline.
+    I sample non sono mai copiati: filtri, troncamenti e mescolamenti agiscono su `order`, la lista degli indici dei sample visibili.
+    I sample non devono avere tutti gli stessi campi: un campo nuovo aggiunge una colonna, e i campi che un sample non ha non compaiono nei suoi record """
+    def __init__(self, fields: list) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            fields(`list(str)`): campi dei sample, escluso `perturbed`
+        """
+        self.fields = list(fields)
+        self.columns = {
+            f: array("q") if f in INT_FIELDS else []
+            for f in self.fields
+        }
+        self.perturbed = {}
+        self.size = 0
+        self.order = array("q")
+
+    @classmethod
+    def from_file(cls,
+                  filename: str,
+                  keep_perturbed: bool = True) -> "SampleStore":
+        """ Carica i sample da un file json (una lista di sample). Gli elementi della lista sono letti e aggiunti alla raccolta uno alla volta, così non sono mai in memoria tutti i dizionari dei sample
+
+        Args:
+            filename(`str`): file json dei sample
+            keep_perturbed(`bool`): se False, i testi perturbati già presenti nel file sono scartati
+        """
+        store = None
+        with open(filename) as f:
+            for index, sample in enumerate(read_json_list(f, filename)):
+                if not isinstance(sample, dict):
+                    raise ValueError(
+                        f"{filename}: l'elemento {index} della lista non è un sample")
+                if not keep_perturbed:
+                    sample.pop("perturbed", None)
+                if store is None:
+                    store = cls([k for k in sample if k != "perturbed"])
+                store.add(sample)
+        return store if store is not None else cls(["text", *INT_FIELDS])
+
+    def add(self, sample: dict) -> None:
+        """ Aggiunge un sample in fondo alla raccolta """
+        for f in sample:
+            if f != "perturbed" and f not in self.columns:
+                self.fields.append(f)
+                self.columns[f] = [MISSING] * self.size
+        for f in self.fields:
+            self.append_value(f, sample.get(f, MISSING))
+        for column in self.perturbed.values():
+            column.append(None)
+        self.order.append(self.size)
+        self.size += 1
+        self.set_perturbed(self.size - 1, sample.get("perturbed", {}))
+
+    def append_value(self, field: str, value) -> None:
+        """ Aggiunge un valore in fondo alla colonna `field`. Una colonna intera che riceve un valore non intero diventa una lista """
+        column = self.columns[field]
+        if type(column) is array:
+            if type(value) is int and -2**63 <= value < 2**63:
+                column.append(value)
+                return
+            column = self.columns[field] = list(column)
+        column.append(value)
+
+    def set_perturbed(self, index: int, perturbed: dict) -> None:
+        """ Salva i testi perturbati del sample `index`
+
+        Args:
+            index(`int`): indice del sample nelle colonne
+            perturbed(`dict`): dizionario che associa ad ogni nome di superpipeline il testo perturbato
+        """
+        for name, text in perturbed.items():
+            column = self.perturbed.get(name)
+            if column is None:
+                column = self.perturbed[name] = [None] * self.size
+            column[index] = text
+
+    def row(self, index: int) -> dict:
+        """ Ritorna i campi del sample `index`, senza i testi perturbati """
+        row = {}
+        for f in self.fields:
+            value = self.columns[f][index]
+            if value is not MISSING:
+                row[f] = value
+        return row
+
+    def record(self, index: int) -> dict:
+        """ Ritorna il sample `index` nel formato del dataset, con i testi perturbati nel campo `perturbed` """
+        return {
+            **self.row(index), "perturbed": {
+                name: column[index]
+                for name, column in self.perturbed.items()
+                if column[index] is not None
+            }
+        }
+
+    def filter(self, keep) -> None:
+        """ Tiene solo i sample visibili per cui `keep(indice)` è True """
+        self.order = array("q", (i for i in self.order if keep(i)))
+
+    def truncate(self, size: int) -> None:
+        """ Tiene solo i primi `size` sample visibili """
+        del self.order[size:]
+
+    def shuffle(self, rng) -> None:
+        """ Mescola i sample visibili con il generatore `rng`. La permutazione è la stessa di `rng.shuffle` su una lista di sample """
+        rng.shuffle(self.order)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __getitem__(self, position: int) -> dict:
+        return self.record(self.order[position])
+
+    def __iter__(self):
+        for index in self.order:
+            yield self.record(index)
+
+    def dump(self, f, size: int = None) -> None:
+        """ Scrive su `f` i primi `size` sample visibili come lista json, con lo stesso formato di `json.dump(..., indent=2)` """
+        write_json_list(f, (self.record(i) for i in self.order[:size]))
+
+
+def write_json_list(f, records) -> None:
+    """ Scrive su `f` gli oggetti di `records` come lista json, uno alla volta, con lo stesso formato di `json.dump(list(records), indent=2)` """
+    separator = "[\n  "
+    for record in records:
+        record = json.dumps(record, indent=2)
+        f.write(separator + record.replace("\n", "\n  "))
+        separator = ",\n  "
+    f.write("[]" if separator == "[\n  " else "\n]")
+
+
+
+def read_json_list(f, filename: str = None, chunk_size: int = 2**16):
+    """ Generatore degli elementi della lista json scritta in `f`, decodificati uno alla volta: in memoria ci sono solo l'elemento corrente e un pezzo del file
+
+    Args:
+        f: file aperto in lettura
+        filename(`str`, optional): nome del file, usato nei messaggi di errore
+        chunk_size(`int`, optional): numero di caratteri letti alla volta
+    """
+    name = filename or getattr(f, "name", "json")
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def next_char():
+        """ Salta gli spazi e ritorna il primo carattere successivo ("" a fine file) """
+        nonlocal buffer, position, eof
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\n\r":
+                position += 1
+            if position < len(buffer) or eof:
+                return buffer[position:position + 1]
+            buffer, position = buffer[position:] + f.read(chunk_size), 0
+            eof = position == len(buffer)
+
+    if next_char() != "[":
+        raise ValueError(f"{name}: il file non contiene una lista json")
+    position += 1
+    if next_char() == "]":
+        return
+    while True:
+        # Un elemento può continuare nel pezzo di file non ancora letto: un numero
+        # è completo solo se dopo di lui c'è un carattere che non può continuarlo
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                if eof or (end < len(buffer) and not (
+                        isinstance(element, (int, float))
+                        and buffer[end] in NUMBER_CHARS)):
+                    break
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"{name}: {e}") from e
+            more = f.read(chunk_size)
+            eof = not more
+            buffer, position = buffer[position:] + more, 0
+        position = end
+        yield element
+        separator = next_char()
+        position += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(
+                f"{name}: atteso ',' o ']' dopo l'elemento della lista, trovato {separator!r}")
+        next_char()
@@ -1,22 +1,83 @@
 import json
 import os
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from tqdm import tqdm
+from document_manifest import DocumentManifest
+
+
+def document_number(fileName: str) -> int:
+    """ Numero del documento contenuto nel file `fileName` """
+    return int(fileName.replace(".json", ""))
+
+
+def read_document(path: str, languages: frozenset) -> tuple:
+    """ Legge un file del dataset. Ritorna la lingua del documento, il numero dei suoi paragrafi e i loro testi, oppure None al posto dei testi se il documento non è in una delle lingue `languages`.
+    Del documento letto è tenuto solo il testo dei paragrafi
+
+    Args:
+        path(`str`): percorso del file
+        languages(`frozenset(str)`): lingue dei documenti da tenere
+    """
+    with open(path) as f:
+        document = json.load(f)
+    language = document["language"]
+    paragraphs = document["paragraphs"]
+    if language not in languages:
+        return language, len(paragraphs), None
+    return language, len(paragraphs), [p["text"] for p in paragraphs]
+
+
+def map_files(function, paths: list, workers: int = 1, threads: bool = False):
+    """ Applica `function` ai file `paths`, in ordine, con `workers` processi (o thread se `threads` è True).
+    I file sono distribuiti a blocchi, così i risultati non ancora consumati non si accumulano in memoria """
+    if workers <= 1:
+        yield from map(function, paths)
+        return
+    paths = iter(paths)
+    with (ThreadPool if threads else Pool)(workers) as pool:
+        while True:
+            batch = list(islice(paths, workers * 16))
+            if not batch:
+                return
+            yield from pool.imap(function, batch)
 
 
 class Sentences_Extractor:
     """ Classe che gestisce l'estrazione dal dataset degli archivi vaticani"""
-    def __init__(self, dataset_folder: str, langauges: list) -> None:
+    def __init__(self,
+                 dataset_folder: str,
+                 langauges: list,
+                 workers: int = 1,
+                 streaming: bool = False,
+                 threads: bool = False,
+                 manifest: bool = True) -> None:
         """ Costruttore base della classe
         
         Args:
             dataset_folder(`str`): directory nella quale è contenuto il dataset
 
             laguages(`list(str)`): lista di lingue delle quali si vuole estrarre il testo
+
+            workers(`int`): numero di processi che leggono i file in parallelo. Di default è 1
+
+            streaming(`bool`): se True, i file non sono letti nel costruttore: i paragrafi sono prodotti uno alla volta da `iter_paragraphs`, senza tenere in memoria tutto il dataset
+
+            threads(`bool`): se True, i file sono letti da `workers` thread invece che da processi
+
+            manifest(`bool`): se True (default) è usato l'indice delle lingue dei documenti salvato accanto alla directory del dataset (vedi document_manifest.py), così sono aperti solo i file nelle lingue scelte. L'indice è creato o aggiornato durante la lettura
          """
         self.dataset_folder = dataset_folder if dataset_folder[
             -1] == "/" else dataset_folder + "/"
         self.languages = langauges
-        self.extractSenteces()
+        self.workers = workers
+        self.threads = threads
+        self.manifest = manifest
+        self.files = None
+        if not streaming:
+            self.extractSenteces()
 
     def fileToData(self, filename: str) -> dict:
         """ Funzione di lettura file """
@@ -38,52 +99,83 @@ class Sentences_Extractor:
             "parPos": 0
         } for i, p in enumerate(paragraphList)]
 
+    def iter_documents(self):
+        """ Generatore delle coppie (numero del documento, lista dei paragrafi) dei documenti nelle lingue scelte, nell'ordine dei nomi dei file.
+        I file sono letti in parallelo e i documenti nelle altre lingue sono scartati appena letti.
+        Con l'indice dei documenti, i file che secondo l'indice sono in altre lingue non sono neanche aperti """
+        languages = frozenset(self.languages)
+        fileNames = sorted(os.listdir(self.dataset_folder))
+        manifest = None
+        stats = {}
+        if self.manifest:
+            manifest = DocumentManifest.for_folder(self.dataset_folder)
+            stats = {f: os.stat(self.dataset_folder + f) for f in fileNames}
+            fileNames = [
+                f for f in fileNames
+                if not self.skipped(manifest, f, stats[f], languages)
+            ]
+        read = partial(read_document, languages=languages)
+        documents = map_files(read,
+                              [self.dataset_folder + f for f in fileNames],
+                              self.workers, self.threads)
+        try:
+            for fileName, (language, paragraphs, pList) in zip(
+                    tqdm(fileNames, "Leggendo i file"), documents):
+                fileNumber = document_number(fileName)
+                if manifest:
+                    manifest.update(fileNumber, stats[fileName], language,
+                                    paragraphs)
+                if pList is not None:
+                    yield fileNumber, self.paragraphListEnriched(
+                        fileNumber, pList)
+        finally:
+            if manifest:
+                manifest.prune(document_number(f) for f in stats)
+                manifest.save()
+
+    def skipped(self, manifest: DocumentManifest, fileName: str,
+                stat: os.stat_result, languages: frozenset) -> bool:
+        """ Ritorna True se secondo l'indice il file `fileName` non è cambiato ed è in una lingua non richiesta """
+        entry = manifest.lookup(document_number(fileName), stat)
+        return entry is not None and entry["language"] not in languages
+
+    def iter_paragraphs(self):
+        """ Generatore dei paragrafi dei documenti nelle lingue scelte, da passare ad esempio a `Sample_Extractor.iter_samples` """
+        for _, paragraphs in self.iter_documents():
+            yield from paragraphs
+
     def extractSenteces(self):
         """ Funzione che estre le frase dai paragrafi """
-        fileNames = sorted(list(os.listdir(self.dataset_folder)))
-
-        # Leggendo i files
-        files = {
-            int(fileName.replace(".json", "")): self.fileToData(fileName)
-            for fileName in tqdm(fileNames, "Leggendo i file")
-        }
-        # Tengo solo quelli nelle lingue scelta
-        files = {
-            fileNumber: file
-            for fileNumber, file in files.items()
-            if file["language"] in self.languages
-        }
-        # Tengo solo i campi paragraph_text e li divido in frasi
-        files = {
-            fileNumber: file["paragraphs"]
-            for fileNumber, file in files.items()
-        }
-
-        files = {
-            fileNumber: [paragraph["text"] for paragraph in file]
-            for fileNumber, file in tqdm(files.items(),
-                                         "Dividendo i paragrafi in frasi")
-        }
-
-        files = {
-            fileNumber: self.paragraphListEnriched(fileNumber, pList)
-            for fileNumber, pList in files.items()
-        }
-
-        self.files = files
+        self.files = dict(self.iter_documents())
 
     def saveToFile(self, outfile_name: str) -> None:
-        """ Salva le frasi estratte in un file creato con il nome di `outfile_name` """
+        """ Salva le frasi estratte in un file creato con il nome di `outfile_name`.
+        Se le frasi non sono già state estratte (con `streaming=True`), i documenti sono letti e scritti uno alla volta """
         print(f"Salvando le frasi in {outfile_name}...")
         with open(outfile_name, "w") as f:
-            json.dump(self.files, f, indent=2)
+            if self.files is not None:
+                json.dump(self.files, f, indent=2)
+            else:
+                write_documents(f, self.iter_documents())
         print(f"{outfile_name} scritto con successo ;)")
 
     def get_extracted_sentences(self) -> dict:
         """ Lista delle frasi estratte """
+        if self.files is None:
+            self.extractSenteces()
         return self.files
 
 
+def write_documents(f, documents) -> None:
+    """ Scrive su `f` le coppie (numero del documento, paragrafi) di `documents` come un unico oggetto json, con lo stesso formato di `json.dump(..., indent=2)` """
+    separator = "{\n"
+    for fileNumber, paragraphs in documents:
+        value = json.dumps(paragraphs, indent=2).replace("\n", "\n  ")
+        f.write(f'{separator}  "{fileNumber}": {value}')
+        separator = ",\n"
+    f.write("{}" if separator == "{\n" else "\n}")
+
+
 def main() -> None:
     extr = Sentences_Extractor("../../Tesi/Dataset/vatpub", ["it"])
     extr.saveToFile("out.json")
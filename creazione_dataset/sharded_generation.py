@@ -0,0 +1,275 @@
+""" Generazione del dataset perturbato a shard, con checkpoint e ripresa.
+
+I sample (da un file JSONL, letto in streaming) sono divisi in shard consecutivi, dimensionati in modo che uno shard perturbato stia nel budget di memoria.
+Ogni shard completato è salvato in un proprio file JSONL nella directory di output e registrato nel manifest `manifest.json`, insieme al seed e ai parametri della generazione.
+Se il processo viene interrotto, `resume` riparte saltando gli shard già completati; `merge` unisce gli shard nel dataset finale, mescolato come in `Dataset_Generator.perturb_samples`.
+
+Uso:
+    python sharded_generation.py run samples.jsonl output_dir [--memory-mb 512] [--workers N] [--seed 0] [--reduced N] [--pipelines S1 T2] [--no-filter]
+    python sharded_generation.py resume output_dir [--workers N]
+    python sharded_generation.py merge output_dir dataset.json [--reduced-file dataset_reduced.json --reduced-size 1000]
+"""
+import argparse
+import json
+import os
+from array import array
+from itertools import islice
+from random import Random
+
+from tqdm import tqdm
+from dataset_generator import selected_samples, iter_perturbed, save_alternatives, sup_pipelines
+from sample_store import write_json_list
+
+MANIFEST = "manifest.json"
+VERSION = 1
+# Rapporto stimato fra la memoria occupata da un sample perturbato e la lunghezza del suo json
+MEMORY_FACTOR = 3
+
+
+def estimate_sample_bytes(samples: list, n_pipelines: int) -> int:
+    """ Stima la memoria occupata da un sample perturbato, a partire da alcuni sample non ancora perturbati
+
+    Args:
+        samples(`list(dict)`): sample di esempio
+        n_pipelines(`int`): numero di superpipeline, cioè di varianti perturbate per sample
+    """
+    if not samples:
+        return 1
+    total = sum(
+        len(json.dumps(s)) + n_pipelines * (len(s["text"]) + 8)
+        for s in samples)
+    return MEMORY_FACTOR * total // len(samples)
+
+
+def shard_filename(index: int) -> str:
+    return f"shard_{index:05d}.jsonl"
+
+
+class ShardedGeneration:
+    """ Generazione a shard del dataset in una directory di output. Lo stato della generazione è nel manifest della directory """
+    def __init__(self, output_dir: str) -> None:
+        """ Costruttore base della classe. Se la directory contiene già un manifest, viene caricato
+
+        Args:
+            output_dir(`str`): directory degli shard e del manifest
+        """
+        self.output_dir = output_dir
+        self.manifest = None
+        if os.path.exists(self.path(MANIFEST)):
+            with open(self.path(MANIFEST)) as f:
+                self.manifest = json.load(f)
+            if self.manifest.get("version") != VERSION:
+                raise ValueError(
+                    f"{self.path(MANIFEST)}: versione del manifest non supportata"
+                )
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.output_dir, filename)
+
+    def save_manifest(self) -> None:
+        """ Salva il manifest. È scritto a parte e poi sostituito, così un'interruzione non lo lascia a metà """
+        with open(self.path(MANIFEST + ".tmp"), "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(self.path(MANIFEST + ".tmp"), self.path(MANIFEST))
+
+    def start(self,
+              samples_filename: str,
+              memory_budget: int = 512 * 2**20,
+              shard_size: int = None,
+              reducedDimension: int = None,
+              filter_paragraphs: bool = True,
+              seed: int = 0,
+              pipelines: list = None,
+              workers: int = 1) -> None:
+        """ Inizia una nuova generazione e la esegue
+
+        Args:
+            samples_filename(`str`): file JSONL dei sample
+            memory_budget(`int`): memoria in byte a disposizione di uno shard, usata per calcolare il numero di sample per shard
+            shard_size(`int`): se impostato, numero di sample per shard (invece di ricavarlo da `memory_budget`)
+            reducedDimension(`int`): se impostato, indica quanti sample perturbare
+            filter_paragraphs(`bool`): se False, la fase di filraggio degli ultimi paragrafi non viene applicata
+            seed(`int`): seed di base della generazione e del mescolamento finale
+            pipelines(`list(str)`): nomi delle superpipeline da usare. Di default sono usate tutte
+            workers(`int`): numero di processi usati per la perturbazione
+        """
+        if self.manifest is not None:
+            raise ValueError(
+                f"{self.output_dir} contiene già una generazione: usare resume")
+        os.makedirs(self.output_dir, exist_ok=True)
+        if shard_size is None:
+            # La stima non richiede il filtraggio, che leggerebbe tutto il file
+            sample = list(
+                islice(selected_samples(samples_filename, None, False),
+                       1000))
+            n_pipelines = len(pipelines or sup_pipelines)
+            shard_size = max(
+                1, memory_budget // estimate_sample_bytes(sample, n_pipelines))
+        stat = os.stat(samples_filename)
+        self.manifest = {
+            "version": VERSION,
+            "input": os.path.abspath(samples_filename),
+            "input_size": stat.st_size,
+            "input_mtime_ns": stat.st_mtime_ns,
+            # Ogni sample è perturbato con un seed derivato da questo (vedi `sample_seed`),
+            # quindi il seed di base è tutto lo stato random necessario per riprendere
+            "seed": seed,
+            "pipelines": list(pipelines) if pipelines else None,
+            "reducedDimension": reducedDimension,
+            "filter_paragraphs": filter_paragraphs,
+            "shard_size": shard_size,
+            "shards": {},
+            "complete": False
+        }
+        self.save_manifest()
+        self.resume(workers)
+
+    def resume(self, workers: int = 1) -> None:
+        """ Esegue (o riprende) la generazione, saltando gli shard già completati
+
+        Args:
+            workers(`int`): numero di processi usati per la perturbazione
+        """
+        manifest = self.manifest
+        if manifest is None:
+            raise ValueError(f"{self.output_dir} non contiene una generazione")
+        stat = os.stat(manifest["input"])
+        if (stat.st_size, stat.st_mtime_ns) != (manifest["input_size"],
+                                                manifest["input_mtime_ns"]):
+            raise ValueError(
+                f"{manifest['input']} è cambiato dall'inizio della generazione")
+        pipelines = tuple(
+            manifest["pipelines"]) if manifest["pipelines"] else None
+        samples = selected_samples(manifest["input"],
+                                   manifest["reducedDimension"],
+                                   manifest["filter_paragraphs"])
+        index = 0
+        while True:
+            shard = list(islice(samples, manifest["shard_size"]))
+            if not shard:
+                break
+            if str(index) not in manifest["shards"]:
+                self.run_shard(index, shard, workers, pipelines)
+            index += 1
+        manifest["complete"] = True
+        self.save_manifest()
+
+    def run_shard(self, index: int, shard: list, workers: int,
+                  pipelines: tuple) -> None:
+        """ Perturba uno shard, lo salva e lo registra nel manifest """
+        lines = [
+            json.dumps(s) + "\n" for s in tqdm(
+                iter_perturbed(shard, workers, self.manifest["seed"],
+                               pipelines),
+                total=len(shard),
+                desc=f"Shard {index}")
+        ]
+        filename = shard_filename(index)
+        with open(self.path(filename + ".tmp"), "w") as f:
+            f.writelines(lines)
+        os.replace(self.path(filename + ".tmp"), self.path(filename))
+        save_alternatives()
+        self.manifest["shards"][str(index)] = {
+            "file": filename,
+            "samples": len(lines)
+        }
+        self.save_manifest()
+
+    def merge(self,
+              filename: str,
+              reduced_filename: str = None,
+              reduced_size: int = None) -> None:
+        """ Unisce gli shard nel dataset finale, in formato json. I sample sono mescolati come in `Dataset_Generator.perturb_samples`, con il seed della generazione.
+        In memoria sono tenute solo le posizioni dei sample nei file degli shard
+
+        Args:
+            filename(`str`): file json in cui salvare il dataset
+            reduced_filename(`str`): se impostato, file json in cui salvare anche i primi `reduced_size` sample del dataset
+            reduced_size(`int`): numero di sample da salvare in `reduced_filename`
+        """
+        if self.manifest is None or not self.manifest["complete"]:
+            raise ValueError(
+                f"La generazione in {self.output_dir} non è completa: usare resume"
+            )
+        shards = [
+            self.manifest["shards"][str(i)]
+            for i in range(len(self.manifest["shards"]))
+        ]
+        files = [open(self.path(s["file"]), "rb") for s in shards]
+        try:
+            # Per ogni sample, il file dello shard e la posizione della sua riga
+            file_ids = array("l")
+            offsets = array("q")
+            for i, f in enumerate(files):
+                offset = 0
+                for line in f:
+                    file_ids.append(i)
+                    offsets.append(offset)
+                    offset += len(line)
+            order = array("q", range(len(offsets)))
+            Random(self.manifest["seed"]).shuffle(order)
+
+            def records(size=None):
+                for i in order[:size]:
+                    f = files[file_ids[i]]
+                    f.seek(offsets[i])
+                    yield json.loads(f.readline())
+
+            print(f"Salvando {len(order)} frasi con perturbazioni in {filename}...")
+            with open(filename, "w") as out:
+                write_json_list(out, records())
+            if reduced_filename:
+                with open(reduced_filename, "w") as out:
+                    write_json_list(out, records(reduced_size))
+        finally:
+            for f in files:
+                f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generazione del dataset perturbato a shard, con ripresa")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="inizia una nuova generazione")
+    run_parser.add_argument("samples")
+    run_parser.add_argument("output_dir")
+    run_parser.add_argument("--memory-mb", type=int, default=512)
+    run_parser.add_argument("--shard-size", type=int, default=None)
+    run_parser.add_argument("--reduced", type=int, default=None)
+    run_parser.add_argument("--no-filter", action="store_true")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--pipelines", nargs="+", default=None)
+    run_parser.add_argument("--workers", type=int, default=1)
+
+    resume_parser = commands.add_parser(
+        "resume", help="riprende una generazione interrotta")
+    resume_parser.add_argument("output_dir")
+    resume_parser.add_argument("--workers", type=int, default=1)
+
+    merge_parser = commands.add_parser(
+        "merge", help="unisce gli shard nel dataset finale")
+    merge_parser.add_argument("output_dir")
+    merge_parser.add_argument("output")
+    merge_parser.add_argument("--reduced-file", default=None)
+    merge_parser.add_argument("--reduced-size", type=int, default=None)
+
+    args = parser.parse_args()
+    generation = ShardedGeneration(args.output_dir)
+    if args.command == "run":
+        generation.start(args.samples,
+                         memory_budget=args.memory_mb * 2**20,
+                         shard_size=args.shard_size,
+                         reducedDimension=args.reduced,
+                         filter_paragraphs=not args.no_filter,
+                         seed=args.seed,
+                         pipelines=args.pipelines,
+                         workers=args.workers)
+    elif args.command == "resume":
+        generation.resume(args.workers)
+    else:
+        generation.merge(args.output, args.reduced_file, args.reduced_size)
+
+
+if __name__ == "__main__":
+    main()
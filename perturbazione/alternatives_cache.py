@@ -0,0 +1,126 @@
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Senza fcntl (Windows) i salvataggi di più processi non sono serializzati
+    fcntl = None
+
+from substitution_matrix import compile_matrix
+
+
+class AlternativesCache:
+    """ Cache delle alternative generate da `TokenSubModule` per ogni token.
+    Ha una dimensione massima (quando è piena viene scartato il token usato meno di recente) e può essere salvata e ricaricata da disco """
+    def __init__(self,
+                 max_size: int = 100000,
+                 filename: str = None,
+                 matrix_fingerprint: str = None) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            max_size(`int`): numero massimo di token nella cache
+            filename(`str`, optional): file in cui salvare la cache. Se esiste già, la cache viene caricata da questo file
+            matrix_fingerprint(`str`, optional): impronta della matrice degli errori con cui sono generate le alternative. Una cache salvata con una matrice diversa non viene caricata
+        """
+        self.max_size = max_size
+        self.filename = filename
+        self.matrix_fingerprint = matrix_fingerprint
+        self.alternatives = OrderedDict()
+        if filename and os.path.exists(filename):
+            self.load(filename)
+
+    @classmethod
+    def for_matrix(cls,
+                   subData,
+                   folder: str,
+                   max_size: int = 100000) -> "AlternativesCache":
+        """ Crea la cache per una matrice degli errori, salvata in `folder` in un file il cui nome dipende dall'impronta della matrice
+
+        Args:
+            subData(`dict` o `SubstitutionMatrix`): matrice degli errori
+            folder(`str`): directory in cui salvare la cache
+            max_size(`int`): numero massimo di token nella cache
+        """
+        fingerprint = compile_matrix(subData).fingerprint
+        filename = os.path.join(folder,
+                                f"alternatives_cache_{fingerprint[:16]}.json")
+        return cls(max_size, filename, fingerprint)
+
+    def get(self, token: str, default=None):
+        """ Ritorna le alternative di `token`, segnandolo come usato di recente """
+        alternatives = self.alternatives.get(token)
+        if alternatives is None:
+            return default
+        self.alternatives.move_to_end(token)
+        return alternatives
+
+    def __setitem__(self, token: str, alternatives: list) -> None:
+        self.alternatives[token] = alternatives
+        self.alternatives.move_to_end(token)
+        while len(self.alternatives) > self.max_size:
+            self.alternatives.popitem(last=False)
+
+    def clear(self) -> None:
+        """ Svuota la cache in memoria, senza toccare il file in cui è salvata """
+        self.alternatives.clear()
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.alternatives
+
+    def __len__(self) -> int:
+        return len(self.alternatives)
+
+    def save(self, filename: str = None) -> None:
+        """ Salva la cache su file, mantenendo l'ordine di utilizzo dei token.
+        Le alternative già salvate nel file (ad esempio da un altro processo) sono unite a quelle della cache, che contano come usate più di recente.
+        Il salvataggio avviene sotto un lock, così più processi possono salvare la stessa cache senza perdere le alternative degli altri
+
+        Args:
+            filename(`str`, optional): file in cui salvare la cache. Di default è quello passato al costruttore
+        """
+        filename = filename or self.filename
+        with locked(filename + ".lock"):
+            merged = AlternativesCache(self.max_size,
+                                       matrix_fingerprint=self.matrix_fingerprint)
+            if os.path.exists(filename):
+                merged.load(filename)
+            for token, alternatives in self.alternatives.items():
+                merged[token] = alternatives
+            tmp_filename = f"{filename}.{os.getpid()}.tmp"
+            with open(tmp_filename, "w") as f:
+                json.dump(
+                    {
+                        "matrix": self.matrix_fingerprint,
+                        "alternatives": merged.alternatives
+                    }, f)
+            os.replace(tmp_filename, filename)
+
+    def load(self, filename: str = None) -> None:
+        """ Carica la cache da file. Se il file è stato creato con una matrice degli errori diversa, non viene caricato nulla
+
+        Args:
+            filename(`str`, optional): file da cui caricare la cache. Di default è quello passato al costruttore
+        """
+        with open(filename or self.filename) as f:
+            data = json.load(f)
+        if data["matrix"] != self.matrix_fingerprint:
+            return
+        for token, alternatives in data["alternatives"].items():
+            self[token] = alternatives
+
+
+@contextmanager
+def locked(lock_filename: str):
+    """ Esegue il blocco `with` tenendo un lock esclusivo sul file `lock_filename`, condiviso fra processi """
+    with open(lock_filename, "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
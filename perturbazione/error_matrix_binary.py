@@ -0,0 +1,149 @@
+""" Formato binario compilato della matrice degli errori.
+
+Il file contiene le stringhe della matrice una volta sola e degli array di indici e di pesi cumulati.
+È letto con `mmap`: gli array non sono copiati in memoria, quindi più processi che caricano lo stesso file ne condividono un'unica copia in sola lettura.
+Il formato di interscambio resta `error_matrix.json`; per convertire fra i due formati:
+    python error_matrix_binary.py error_matrix.json error_matrix.bin
+    python error_matrix_binary.py error_matrix.bin error_matrix.json
+"""
+import json
+import mmap
+import struct
+import sys
+
+sys.path.insert(0, "../utils/")
+from utils import WeightedSampler
+from substitution_matrix import SubstitutionMatrix, compile_matrix
+
+MAGIC = b"EMTX"
+VERSION = 2
+# magic, versione, impronta, numero di stringhe, byte delle stringhe,
+# numero di chiavi di `count`, numero di righe di `subs`, numero di alternative,
+# 4 byte di riempimento perché le sezioni che seguono inizino allineate a 8 byte
+HEADER = struct.Struct("<4sI40sIIIII4x")
+
+
+def pad(data: bytes) -> bytes:
+    """ Allinea una sezione del file a 8 byte """
+    return data + b"\0" * (-len(data) % 8)
+
+
+def dump_binary(subData, filename: str) -> None:
+    """ Salva una matrice degli errori nel formato binario
+
+    Args:
+        subData(`dict` o `SubstitutionMatrix`): matrice degli errori
+        filename(`str`): file in cui salvare la matrice
+    """
+    matrix = compile_matrix(subData)
+    data = matrix.to_dict()
+    strings = {}
+
+    def string_id(string):
+        return strings.setdefault(string, len(strings))
+
+    count_keys = [string_id(k) for k in data["count"]]
+    count_probs = list(data["count"].values())
+    subs_keys = []
+    row_offsets = [0]
+    alternatives = []
+    cumulative = []
+    for key, row in data["subs"].items():
+        subs_keys.append(string_id(key))
+        total = 0
+        for alternative, weight in row.items():
+            if not isinstance(weight, int):
+                raise ValueError(
+                    f"Il peso di {key!r} -> {alternative!r} non è intero")
+            total += weight
+            alternatives.append(string_id(alternative))
+            cumulative.append(total)
+        row_offsets.append(len(alternatives))
+
+    encoded = [s.encode("utf-8") for s in strings]
+    string_offsets = [0]
+    for e in encoded:
+        string_offsets.append(string_offsets[-1] + len(e))
+    blob = b"".join(encoded)
+
+    with open(filename, "wb") as f:
+        f.write(
+            HEADER.pack(MAGIC, VERSION, matrix.fingerprint.encode("ascii"),
+                        len(encoded), len(blob), len(count_keys),
+                        len(subs_keys), len(alternatives)))
+        for fmt, values in (("I", string_offsets), ("I", count_keys),
+                            ("d", count_probs), ("I", subs_keys),
+                            ("I", row_offsets), ("I", alternatives),
+                            ("Q", cumulative)):
+            f.write(pad(struct.pack(f"<{len(values)}{fmt}", *values)))
+        f.write(blob)
+
+
+def load_binary(filename: str) -> SubstitutionMatrix:
+    """ Carica una matrice degli errori in formato binario. Gli indici e i pesi restano nel file mappato in memoria
+
+    Args:
+        filename(`str`): file della matrice
+    """
+    with open(filename, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    (magic, version, fingerprint, n_strings, blob_size, n_count, n_subs,
+     n_alternatives) = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError(f"{filename} non è una matrice degli errori binaria")
+    if version != VERSION:
+        raise ValueError(
+            f"{filename} è scritto con la versione {version} del formato binario (attuale: {VERSION}): va ricreato da error_matrix.json"
+        )
+
+    position = HEADER.size
+
+    # Il file è scritto little-endian, come l'ordine dei byte delle macchine x86/ARM
+    def section(fmt, length):
+        nonlocal position
+        size = struct.calcsize(fmt) * length
+        array = view[position:position + size].cast(fmt)
+        position += size + (-size % 8)
+        return array
+
+    string_offsets = section("I", n_strings + 1)
+    count_keys = section("I", n_count)
+    count_probs = section("d", n_count)
+    subs_keys = section("I", n_subs)
+    row_offsets = section("I", n_subs + 1)
+    alternatives = section("I", n_alternatives)
+    cumulative = section("Q", n_alternatives)
+    blob = view[position:position + blob_size]
+    strings = [
+        sys.intern(
+            str(blob[string_offsets[i]:string_offsets[i + 1]], "utf-8"))
+        for i in range(n_strings)
+    ]
+
+    count = {strings[k]: p for k, p in zip(count_keys, count_probs)}
+    samplers = {}
+    for i, key in enumerate(subs_keys):
+        start, end = row_offsets[i], row_offsets[i + 1]
+        samplers[strings[key]] = WeightedSampler.from_cumulative(
+            [strings[a] for a in alternatives[start:end]],
+            cumulative[start:end])
+    return SubstitutionMatrix.from_samplers(count, samplers,
+                                            fingerprint.decode("ascii"))
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    source, destination = sys.argv[1:]
+    if source.endswith(".json"):
+        with open(source) as f:
+            dump_binary(json.load(f), destination)
+    else:
+        with open(destination, "w") as f:
+            json.dump(load_binary(source).to_dict(), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,21 @@
+""" Estrazione della matrice degli errori a partire da una lista di correzioni.
+
+Uso:
+    python error_matrix_extraction.py [--input correction_examples.json] [--output error_matrix.json] [--workers N]
+    python error_matrix_extraction.py --update --input nuove_correzioni.json
+
+Oltre alla matrice, viene salvato il file dei conteggi grezzi (di default `error_matrix_counts.json`):
+con `--update` le nuove correzioni sono sommate a quei conteggi e la matrice è ricalcolata senza rielaborare le correzioni precedenti.
+"""
+import argparse
+import copy
 import json
+import os
+from itertools import islice
+from multiprocessing import Pool
 from tqdm import tqdm
 from Levenshtein import distance, matching_blocks, editops
 
-with open("./correction_examples.json") as f:
-    corrections = json.load(f)
-
 
 def map_to_range(value, fromMin, fromMax, toMin, toMax):
     # Figure out how 'wide' each range is
@@ -85,19 +96,235 @@ def dict_to_prob(count):
     return count
 
 
-inverted = invert(corrections)
-confMatrix = extractMatrix(inverted)
-filterByFrequency(confMatrix, 7)
+def iter_json_object(filename, read_size=1 << 20):
+    """ Legge in streaming le coppie (chiave, valore) dell'oggetto json contenuto in `filename`, senza caricare tutto il file in memoria """
+    decoder = json.JSONDecoder()
+    with open(filename) as f:
+        state = {"buffer": "", "pos": 0, "eof": False}
+
+        def fill():
+            data = f.read(read_size)
+            if not data:
+                state["eof"] = True
+                return False
+            state["buffer"] = state["buffer"][state["pos"]:] + data
+            state["pos"] = 0
+            return True
+
+        def next_char():
+            while True:
+                buffer, pos = state["buffer"], state["pos"]
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                state["pos"] = pos
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not fill():
+                    return None
+
+        def expect(chars):
+            char = next_char()
+            if char is None or char not in chars:
+                raise ValueError(
+                    f"{filename}: atteso uno fra {chars!r}, trovato {char!r}")
+            state["pos"] += 1
+            return char
+
+        def value():
+            next_char()
+            while True:
+                try:
+                    decoded, end = decoder.raw_decode(state["buffer"],
+                                                      state["pos"])
+                except ValueError:
+                    if not fill():
+                        raise
+                    continue
+                # Un valore che arriva a fine buffer potrebbe essere troncato
+                if end < len(state["buffer"]) or state["eof"] or not fill():
+                    state["pos"] = end
+                    return decoded
+
+        expect("{")
+        if next_char() == "}":
+            return
+        while True:
+            key = value()
+            expect(":")
+            yield key, value()
+            if expect(",}") == "}":
+                return
+
+
+def iter_chunks(iterable, size):
+    """ Divide un iterabile in liste di al più `size` elementi """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def count_chunk(chunk):
+    """ Elabora un blocco di correzioni: filtra le coppie con distanza troppo alta ed estrae i caratteri sostituiti.
+    Ritorna un dizionario che associa ad ogni coppia (caratteri originali, caratteri sbagliati) il numero di occorrenze e la chiave d'ordine della prima occorrenza
+
+    Args:
+        chunk(`list`): lista di tuple (chiave d'ordine, parola sbagliata, parola corretta)
+    """
+    counts = {}
+    for order_key, incorrect_word, correct_word in chunk:
+        if distance(incorrect_word, correct_word) >= 3:
+            continue
+        pair = extractPair(correct_word, incorrect_word)
+        entry = counts.get(pair)
+        if entry is None:
+            counts[pair] = [1, order_key]
+        else:
+            entry[0] += 1
+            entry[1] = min(entry[1], order_key)
+    return counts
+
+
+def merge_counts(total, partial):
+    """ Unisce i conteggi `partial` di un blocco in `total` """
+    for pair, (count, order_key) in partial.items():
+        entry = total.get(pair)
+        if entry is None:
+            total[pair] = [count, order_key]
+        else:
+            entry[0] += count
+            entry[1] = min(entry[1], order_key)
+
+
+def ordered_matrix(counts):
+    """ Costruisce la matrice dei conteggi dai conteggi per coppia, con le chiavi nello stesso ordine di `extractMatrix(invert(corrections))` """
+    confMatrix = {}
+    for (original_chars, mistaken_chars), (count, _) in sorted(
+            counts.items(), key=lambda item: item[1][1]):
+        confMatrix.setdefault(original_chars, {})[mistaken_chars] = count
+    return confMatrix
+
+
+def extract_counts(filename, workers=1, chunk_size=10000):
+    """ Legge in streaming le correzioni di `filename` e ne conta le coppie di caratteri sostituiti, con un pool di `workers` processi
+
+    Args:
+        filename(`str`): file json con le correzioni, un oggetto che associa ad ogni parola sbagliata la sua correzione
+        workers(`int`): numero di processi usati per l'elaborazione
+        chunk_size(`int`): numero di correzioni elaborate da un processo alla volta
+    """
+    first_seen = {}
+
+    def tagged_corrections():
+        # La chiave d'ordine riproduce l'ordine di `extractMatrix(invert(...))`:
+        # prima per prima comparsa della parola corretta, poi per posizione nel file
+        for i, (incorrect_word,
+                correct_word) in enumerate(iter_json_object(filename)):
+            first = first_seen.setdefault(correct_word, i)
+            yield ((first, i), incorrect_word, correct_word)
+
+    counts = {}
+    chunks = iter_chunks(tagged_corrections(), chunk_size)
+    progress = tqdm(desc="Creando la confusion misspelling matrix",
+                    unit="blocchi")
+    if workers > 1:
+        with Pool(workers) as pool:
+            # I blocchi sono inviati a gruppi, per non leggere tutto il file in anticipo
+            for group in iter_chunks(chunks, workers * 4):
+                for partial in pool.imap_unordered(count_chunk, group):
+                    merge_counts(counts, partial)
+                    progress.update(1)
+    else:
+        for chunk in chunks:
+            merge_counts(counts, count_chunk(chunk))
+            progress.update(1)
+    progress.close()
+    return counts
+
+
+def build_error_matrix(confMatrix, threshold=7):
+    """ Filtra la matrice dei conteggi e calcola le probabilità delle chiavi. Ritorna il contenuto di `error_matrix.json`
+
+    Args:
+        confMatrix(`dict`): matrice dei conteggi, viene modificata
+        threshold(`int`): numero minimo di occorrenze di una sostituzione per essere tenuta
+    """
+    filterByFrequency(confMatrix, threshold)
+
+    count = dict_to_prob({
+        orig_char: sum(sub_dict.values())
+        for orig_char, sub_dict in confMatrix.items()
+    })
+
+    confMatrix.pop('', None)
+    count.pop('', None)
+
+    return {"subs": confMatrix, "count": count}
+
+
+def counts_filename(matrix_filename):
+    """ Nome del file dei conteggi grezzi associato al file della matrice """
+    return os.path.splitext(matrix_filename)[0] + "_counts.json"
+
+
+def load_counts(filename):
+    """ Carica la matrice dei conteggi grezzi """
+    with open(filename) as f:
+        return json.load(f)["counts"]
+
+
+def save_counts(confMatrix, filename):
+    """ Salva la matrice dei conteggi grezzi (non filtrata) """
+    with open(filename, "w") as f:
+        json.dump({"counts": confMatrix}, f, indent=2)
+
+
+def fold_counts(store, confMatrix):
+    """ Somma ai conteggi grezzi `store` quelli di un nuovo blocco di correzioni. Le coppie nuove sono aggiunte in coda
+
+    Args:
+        store(`dict`): matrice dei conteggi grezzi, viene modificata
+        confMatrix(`dict`): matrice dei conteggi del nuovo blocco
+    """
+    for original_chars, mistaken_chars_dict in confMatrix.items():
+        row = store.setdefault(original_chars, {})
+        for mistaken_chars, count in mistaken_chars_dict.items():
+            row[mistaken_chars] = row.get(mistaken_chars, 0) + count
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Crea la matrice degli errori da una lista di correzioni")
+    parser.add_argument("--input", default="./correction_examples.json")
+    parser.add_argument("--output", default="error_matrix.json")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--threshold", type=int, default=7)
+    parser.add_argument(
+        "--counts",
+        default=None,
+        help="file dei conteggi grezzi (di default accanto a --output)")
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="somma le correzioni di --input ai conteggi già salvati")
+    args = parser.parse_args()
+    counts_file = args.counts or counts_filename(args.output)
+
+    confMatrix = ordered_matrix(
+        extract_counts(args.input, args.workers, args.chunk_size))
+    if args.update:
+        confMatrix = fold_counts(load_counts(counts_file), confMatrix)
+    save_counts(confMatrix, counts_file)
 
-count = dict_to_prob({
-    orig_char: sum(sub_dict.values())
-    for orig_char, sub_dict in confMatrix.items()
-})
+    output = build_error_matrix(copy.deepcopy(confMatrix), args.threshold)
 
-del (confMatrix[''])
-del (count[''])
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
 
-output = {"subs": confMatrix, "count": count}
 
-with open("error_matrix.json", "w") as f:
-    json.dump(output, f, indent=2)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+""" Strumentazione (facoltativa) dell'esecuzione di pipeline e superpipeline.
+
+Finché non è attivato un `Profiler` con `enabled`, `Pipeline` e `SuperPipeline` controllano solo che `active` sia None e non misurano nulla.
+Con un profiler attivo sono raccolti, per ogni superpipeline:
+- il tempo totale e il numero di esecuzioni (`runs`, `seconds`);
+- quante volte ogni pipeline è stata scelta per un blocco (`blocks`);
+- per ogni modulo di ogni pipeline il tempo, i token in ingresso e in uscita e il numero di gruppi di token perturbati (`pipelines`);
+- il tempo della tokenizzazione condivisa e della detokenizzazione (`stages`).
+"""
+import json
+import time
+from contextlib import contextmanager
+
+# Profiler attivo, oppure None se la strumentazione è disattivata
+active = None
+
+
+@contextmanager
+def enabled(profiler: "Profiler"):
+    """ Attiva `profiler` per il blocco `with`, ripristinando alla fine quello precedente """
+    global active
+    previous = active
+    active = profiler
+    try:
+        yield profiler
+    finally:
+        active = previous
+
+
+def merge_stats(total: dict, partial: dict) -> dict:
+    """ Somma le statistiche `partial` in `total`, ricorsivamente """
+    for key, value in partial.items():
+        if isinstance(value, dict):
+            merge_stats(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+class Profiler:
+    """ Raccoglie tempi e contatori dell'esecuzione delle superpipeline, aggregati per superpipeline """
+    def __init__(self) -> None:
+        self.stats = {}
+        # Superpipeline e pipeline a cui sono attribuite le misure correnti
+        self.superpipeline = "-"
+        self.pipeline = "-"
+
+    def add(self, *path, **counts) -> None:
+        """ Somma i contatori `counts` a quelli del percorso `path` della superpipeline corrente """
+        node = self.stats.setdefault(self.superpipeline, {})
+        for key in path:
+            node = node.setdefault(key, {})
+        for key, value in counts.items():
+            node[key] = node.get(key, 0) + value
+
+    @contextmanager
+    def section(self, name: str):
+        """ Attribuisce alla superpipeline `name` le misure raccolte nel blocco `with`, misurandone il tempo totale """
+        previous = self.superpipeline
+        self.superpipeline = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(runs=1, seconds=time.perf_counter() - start)
+            self.superpipeline = previous
+
+    def choose(self, index: int) -> None:
+        """ Registra la pipeline `index` scelta per il blocco corrente """
+        self.pipeline = str(index)
+        self.add("blocks", **{self.pipeline: 1})
+
+    def module(self, position: int, name: str, seconds: float,
+               **counts) -> None:
+        """ Registra un'applicazione del modulo in posizione `position` della pipeline corrente
+
+        Args:
+            position(`int`): posizione del modulo nella pipeline
+            name(`str`): nome del modulo
+            seconds(`float`): tempo impiegato
+            counts: contatori del modulo (ad esempio tokens_in, tokens_out, groups)
+        """
+        self.add("pipelines",
+                 self.pipeline,
+                 f"{position}:{name}",
+                 calls=1,
+                 seconds=seconds,
+                 **counts)
+
+    def stage(self, name: str, seconds: float, **counts) -> None:
+        """ Registra una fase della superpipeline esterna alle pipeline (tokenizzazione condivisa, detokenizzazione) """
+        self.add("stages", name, calls=1, seconds=seconds, **counts)
+
+    def merge(self, stats: dict) -> None:
+        """ Somma alle statistiche raccolte quelle di un altro profiler (ad esempio di un altro processo) """
+        merge_stats(self.stats, stats)
+
+    def dump(self, filename: str) -> None:
+        """ Salva le statistiche in json """
+        with open(filename, "w") as f:
+            json.dump(self.stats, f, indent=2)
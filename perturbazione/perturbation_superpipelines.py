@@ -1,13 +1,52 @@
 import json
+import os
+from collections.abc import Mapping
+from functools import lru_cache
 from pipeline import DetokenizerModule, SuperPipeline, TokenizerModule
 from pipeline import Pipeline, SplitModuleGenerator, CharsSubModule, AddPunctuationModule, MergeWordHyphenModule, SplitWithCommaModule, TokenSubModule
+from alternatives_cache import AlternativesCache
+from error_matrix_binary import load_binary
+
+# Le superpipeline, la matrice degli errori e la cache delle alternative sono
+# costruite solo quando vengono richieste: importare questo file non costa nulla
 
 tokenSub_activated = True
+# Backend di tokenizzazione ("regex" oppure "nltk", vedi utils/tokenizer_backends.py)
+tokenizer_backend = "regex"
+
+matrix_json = "../perturbazione/error_matrix.json"
+matrix_binary = "../perturbazione/error_matrix.bin"
+# Directory in cui è salvata la cache delle alternative. La variabile d'ambiente
+# ALTERNATIVES_CACHE_DIR la sostituisce, anche nei processi figli (ad esempio nei benchmark)
+alternatives_folder = "../perturbazione/"
+
+
+@lru_cache(maxsize=None)
+def error_matrix():
+    """ Carica la matrice degli errori. Se è presente una versione binaria aggiornata della matrice (vedi error_matrix_binary.py) si usa quella """
+    if os.path.exists(matrix_binary) and os.path.getmtime(
+            matrix_binary) >= os.path.getmtime(matrix_json):
+        try:
+            return load_binary(matrix_binary)
+        except ValueError as e:
+            print(f"{e}. Uso {matrix_json}")
+    with open(matrix_json) as f:
+        return json.load(f)
+
 
-with open("../perturbazione/error_matrix.json") as f:
-    subData = json.load(f)
+@lru_cache(maxsize=None)
+def alternatives_cache() -> AlternativesCache:
+    """ Cache delle alternative condivisa da tutte le pipeline di sostituzione token, salvata accanto alla matrice degli errori """
+    folder = os.environ.get("ALTERNATIVES_CACHE_DIR", alternatives_folder)
+    return AlternativesCache.for_matrix(error_matrix(),
+                                        folder,
+                                        max_size=200000)
 
-altDict = {}
+
+def save_alternatives() -> None:
+    """ Salva la cache delle alternative, se è stata usata """
+    if alternatives_cache.cache_info().currsize:
+        alternatives_cache().save()
 
 
 def token_pipeline(p_charsub, sub_data):
@@ -45,136 +84,97 @@ def fullPipeline(tkn_pipeline, sgm_pipeleine):
     return pipeline
 
 
-easySegPipeline = segmentation_pipeline(p_mergehyphen=0.001,
-                                        p_splitcomma=0.001,
-                                        p_split=0.0025,
-                                        p_punctadd=0.005)
-
-mediumSegPipeline = segmentation_pipeline(p_mergehyphen=0.001,
-                                          p_splitcomma=0.002,
-                                          p_split=0.008,
-                                          p_punctadd=0.025)
-
-hardSegPipeline = segmentation_pipeline(p_mergehyphen=0.01,
-                                        p_splitcomma=0.02,
-                                        p_split=0.05,
-                                        p_punctadd=0.1)
-
-easySegPipeline.addTokenization(TokenizerModule())
-mediumSegPipeline.addTokenization(TokenizerModule())
-hardSegPipeline.addTokenization(TokenizerModule())
-
-S1 = SuperPipeline(stickyness=0.8,
-                   block_size=800,
-                   detokenizer=DetokenizerModule())
-
-S2 = SuperPipeline(stickyness=0.8,
-                   block_size=800,
-                   detokenizer=DetokenizerModule())
-
-S3 = SuperPipeline(stickyness=0.8,
-                   block_size=800,
-                   detokenizer=DetokenizerModule())
-
-S1.addPipeline(easySegPipeline, weight=6)
-S1.addPipeline(mediumSegPipeline, weight=4)
-S1.addPipeline(hardSegPipeline, weight=1)
-
-S2.addPipeline(easySegPipeline, weight=2)
-S2.addPipeline(mediumSegPipeline, weight=8)
-S2.addPipeline(hardSegPipeline, weight=1)
-
-S3.addPipeline(easySegPipeline, weight=1)
-S3.addPipeline(mediumSegPipeline, weight=6)
-S3.addPipeline(hardSegPipeline, weight=4)
-
-easyTknPipeline = token_pipeline(p_charsub=0.1, sub_data=subData)
-
-mediumTknPipeline = token_pipeline(p_charsub=0.3, sub_data=subData)
-
-hardTknPipeline = token_pipeline(p_charsub=0.8, sub_data=subData)
+LEVELS = ["easy", "medium", "hard"]
 
-if tokenSub_activated:
-    easyTknPipeline = token_pipeline_token_version(p_tokensub=0.1,
-                                                   sub_data=subData,
-                                                   altDict=altDict)
-
-    mediumTknPipeline = token_pipeline_token_version(p_tokensub=0.3,
-                                                     sub_data=subData,
-                                                     altDict=altDict)
-
-    hardTknPipeline = token_pipeline_token_version(p_tokensub=0.8,
-                                                   sub_data=subData,
-                                                   altDict=altDict)
-
-eTkn = easyTknPipeline.clone()
-mTkn = mediumTknPipeline.clone()
-hTkn = hardTknPipeline.clone()
-
-easyTknPipeline.addTokenization(TokenizerModule())
-mediumTknPipeline.addTokenization(TokenizerModule())
-hardTknPipeline.addTokenization(TokenizerModule())
-
-T1 = SuperPipeline(stickyness=0.8,
-                   block_size=800,
-                   detokenizer=DetokenizerModule())
-
-T2 = SuperPipeline(stickyness=0.8,
-                   block_size=800,
-                   detokenizer=DetokenizerModule())
-
-T3 = SuperPipeline(stickyness=0.8,
-                   block_size=800,
-                   detokenizer=DetokenizerModule())
-
-T1.addPipeline(easyTknPipeline, weight=6)
-T1.addPipeline(mediumTknPipeline, weight=4)
-T1.addPipeline(hardTknPipeline, weight=1)
-
-T2.addPipeline(easyTknPipeline, weight=2)
-T2.addPipeline(mediumTknPipeline, weight=8)
-T2.addPipeline(hardTknPipeline, weight=1)
-
-T3.addPipeline(easyTknPipeline, weight=1)
-T3.addPipeline(mediumTknPipeline, weight=6)
-T3.addPipeline(hardTknPipeline, weight=4)
-
-M1 = SuperPipeline(stickyness=0.8,
-                   block_size=800,
-                   detokenizer=DetokenizerModule())
-
-M2 = SuperPipeline(stickyness=0.8,
-                   block_size=800,
-                   detokenizer=DetokenizerModule())
-
-M3 = SuperPipeline(stickyness=0.8,
-                   block_size=800,
-                   detokenizer=DetokenizerModule())
-
-easyMixedPipeline = easySegPipeline.clone().concatPipeline(eTkn)
-mediumMixedPipeline = mediumSegPipeline.clone().concatPipeline(mTkn)
-hardMixedPipeline = hardSegPipeline.clone().concatPipeline(hTkn)
-
-M1.addPipeline(easyMixedPipeline, weight=6)
-M1.addPipeline(mediumMixedPipeline, weight=4)
-M1.addPipeline(hardMixedPipeline, weight=1)
-
-M2.addPipeline(easyMixedPipeline, weight=2)
-M2.addPipeline(mediumMixedPipeline, weight=8)
-M2.addPipeline(hardMixedPipeline, weight=1)
-
-M3.addPipeline(easyMixedPipeline, weight=1)
-M3.addPipeline(mediumMixedPipeline, weight=6)
-M3.addPipeline(hardMixedPipeline, weight=4)
-
-sup_pipelines = {
-    "M1": M1,
-    "M2": M2,
-    "M3": M3,
-    "S1": S1,
-    "S2": S2,
-    "S3": S3,
-    "T1": T1,
-    "T2": T2,
-    "T3": T3
+segmentation_params = {
+    "easy":
+    dict(p_mergehyphen=0.001, p_splitcomma=0.001, p_split=0.0025,
+         p_punctadd=0.005),
+    "medium":
+    dict(p_mergehyphen=0.001, p_splitcomma=0.002, p_split=0.008,
+         p_punctadd=0.025),
+    "hard":
+    dict(p_mergehyphen=0.01, p_splitcomma=0.02, p_split=0.05, p_punctadd=0.1)
 }
+
+token_params = {"easy": 0.1, "medium": 0.3, "hard": 0.8}
+
+# Pesi delle pipeline easy, medium e hard nelle superpipeline 1, 2 e 3
+superpipeline_weights = {"1": (6, 4, 1), "2": (2, 8, 1), "3": (1, 6, 4)}
+
+
+@lru_cache(maxsize=None)
+def token_modules(level: str) -> Pipeline:
+    """ Pipeline (senza tokenizzazione) di sostituzione caratteri o token del livello `level` """
+    if tokenSub_activated:
+        return token_pipeline_token_version(p_tokensub=token_params[level],
+                                            sub_data=error_matrix(),
+                                            altDict=alternatives_cache())
+    return token_pipeline(p_charsub=token_params[level],
+                          sub_data=error_matrix())
+
+
+@lru_cache(maxsize=None)
+def level_pipeline(kind: str, level: str) -> Pipeline:
+    """ Pipeline con tokenizzazione del tipo `kind` (S: segmentazione, T: sostituzione token, M: entrambe) e del livello `level`.
+    Le pipeline sono costruite una volta sola e condivise fra le superpipeline """
+    if kind == "S":
+        pipeline = segmentation_pipeline(**segmentation_params[level])
+        return pipeline.addTokenization(TokenizerModule(tokenizer_backend))
+    if kind == "T":
+        return token_modules(level).clone().addTokenization(
+            TokenizerModule(tokenizer_backend))
+    return level_pipeline("S", level).clone().concatPipeline(
+        token_modules(level))
+
+
+def build_superpipeline(name: str) -> SuperPipeline:
+    """ Costruisce la superpipeline `name` (ad esempio "S1", "T2" o "M3") """
+    kind, variant = name[0], name[1:]
+    sup = SuperPipeline(stickyness=0.8,
+                        block_size=800,
+                        detokenizer=DetokenizerModule())
+    for level, weight in zip(LEVELS, superpipeline_weights[variant]):
+        sup.addPipeline(level_pipeline(kind, level), weight=weight)
+    return sup
+
+
+class SuperPipelineRegistry(Mapping):
+    """ Dizionario delle superpipeline: ognuna è costruita solo la prima volta che viene richiesta """
+    def __init__(self, names: list, builder) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            names(`list(str)`): nomi delle superpipeline disponibili
+            builder: funzione che costruisce una superpipeline dato il suo nome
+        """
+        self.names = list(names)
+        self.builder = builder
+        self.built = {}
+
+    def __getitem__(self, name: str) -> SuperPipeline:
+        if name not in self.names:
+            raise KeyError(name)
+        if name not in self.built:
+            self.built[name] = self.builder(name)
+        return self.built[name]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def select(self, names: list = None) -> dict:
+        """ Ritorna un dizionario con le sole superpipeline `names` (tutte se `names` è None), nell'ordine del registro """
+        if names is None:
+            names = self.names
+        unknown = set(names) - set(self.names)
+        if unknown:
+            raise KeyError(f"Superpipeline sconosciute: {sorted(unknown)}")
+        return {name: self[name] for name in self.names if name in names}
+
+
+sup_pipelines = SuperPipelineRegistry(
+    ["M1", "M2", "M3", "S1", "S2", "S3", "T1", "T2", "T3"],
+    build_superpipeline)
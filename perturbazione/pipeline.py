@@ -1,18 +1,71 @@
 from abc import abstractmethod
+from bisect import bisect_right
 import sys
+import time
 from typing import Callable
 
 sys.path.insert(0, "../utils/")
-from utils import probability_boolean, find_all, randint, shuffle, random_choice, weighted_choice
+from utils import probability_boolean, bernoulli_hits, randint, shuffle, random_choice, weighted_choice, seeded, derive_seed, set_seed
 from itertools import chain
-from nltk import word_tokenize
-from detokenize import detokenize
+from detokenize import detokenize, detokenize_many, detokenize_stream
+from tokenizer_backends import get_tokenizer
+from substitution_matrix import compile_matrix
+from alternatives_cache import AlternativesCache
+import instrumentation
+
+
+class TokenBatch:
+    """ Lotto di testi tokenizzati, tenuti in un'unica lista piatta di token invece che in una lista per testo.
+    I token del testo `i` sono `tokens[offsets[i]:offsets[i + 1]]` """
+    __slots__ = ("tokens", "offsets")
+
+    def __init__(self, tokens: list, offsets: list) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            tokens(`list(str)`): token di tutti i testi, uno dopo l'altro
+            offsets(`list(int)`): posizione in `tokens` del primo token di ogni testo, seguita dal numero totale di token
+        """
+        self.tokens = tokens
+        self.offsets = offsets
+
+    @classmethod
+    def from_lists(cls, lists) -> "TokenBatch":
+        """ Crea un lotto dalle liste di token dei testi """
+        tokens = []
+        offsets = [0]
+        for token_list in lists:
+            tokens.extend(token_list)
+            offsets.append(len(tokens))
+        return cls(tokens, offsets)
+
+    def select(self, indices) -> "TokenBatch":
+        """ Ritorna un nuovo lotto con i soli testi `indices`, nell'ordine dato """
+        tokens = []
+        offsets = [0]
+        for i in indices:
+            tokens.extend(self.tokens[self.offsets[i]:self.offsets[i + 1]])
+            offsets.append(len(tokens))
+        return TokenBatch(tokens, offsets)
+
+    def to_lists(self) -> list:
+        """ Ritorna le liste di token dei testi """
+        return [self[i] for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> list:
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
 
 
 class PerturbationModule:
     """ Modulo di perturbazione base. Il suo funzionamento è dato dalla funzione di perturbazione base fornita nel costruttore """
-    def __init__(self, perturbation_function: Callable, token_grouping: int,
-                 probability: float) -> None:
+    def __init__(self,
+                 perturbation_function: Callable,
+                 token_grouping: int,
+                 probability: float,
+                 name: str = None) -> None:
         """ Costruttore base della classe
         
         Args:
@@ -21,10 +74,14 @@ class PerturbationModule:
             token_grouping:(:obj:`int`): numero di token che la funzione di perturbazione prende in gruppo per la perturbazione
 
             probability(:obj:`float`): probabilità da 0 a 1 che la funzione di perturbazione perturbi un certo gruppo di token
+
+            name(:obj:`str`, optional): nome del modulo usato dalla strumentazione. Di default è il nome della funzione di perturbazione (o del suo tipo, se non ha un nome)
          """
         self.perturbation_function = perturbation_function
         self.token_grouping = token_grouping
         self.probability = probability
+        self.name = name or getattr(perturbation_function, "__name__",
+                                    type(perturbation_function).__name__)
 
     def group(self, tokens: list) -> list:
         """ Funzione che prende in input una lista di token e li ritorna raggruppati in gruppi da :obj:`self.token_grouping` tokens
@@ -49,24 +106,317 @@ class PerturbationModule:
         Args:
             tokens: lista di token da perturbare
         """
-        perturbed_list = [
-            self.perturbation_function(t)
-            if probability_boolean(self.probability)
-            and len(t) == self.token_grouping else t
-            for t in self.group(tokens)
-        ]
-        return list(chain.from_iterable(perturbed_list))
+        return self.apply_counted(tokens)[0]
+
+    def apply_counted(self, tokens: list) -> tuple:
+        """ Come `apply`, ma ritorna anche il numero di gruppi di token perturbati """
+        group_size = self.token_grouping
+        groups_number = (len(tokens) + group_size - 1) // group_size
+        perturbed_list = []
+        copied = 0
+        perturbed_groups = 0
+        # Solo i gruppi estratti sono toccati, il resto è copiato a blocchi
+        for i in bernoulli_hits(groups_number, self.probability):
+            start = i * group_size
+            group = tokens[start:start + group_size]
+            if len(group) != group_size:
+                continue
+            perturbed_list.extend(tokens[copied:start])
+            perturbed_list.extend(self.perturbation_function(group))
+            copied = start + group_size
+            perturbed_groups += 1
+        perturbed_list.extend(tokens[copied:])
+        return perturbed_list, perturbed_groups
+
+    def apply_profiled(self, tokens: list, profiler, position: int) -> list:
+        """ Come `apply`, registrando tempo e contatori del modulo in `profiler` (vedi instrumentation.py)
+
+        Args:
+            tokens: lista di token da perturbare
+            profiler(`Profiler`): profiler attivo
+            position(`int`): posizione del modulo nella pipeline
+        """
+        start = time.perf_counter()
+        perturbed, groups = self.apply_counted(tokens)
+        profiler.module(position,
+                        self.name,
+                        time.perf_counter() - start,
+                        tokens_in=len(tokens),
+                        tokens_out=len(perturbed),
+                        groups=groups)
+        return perturbed
+
+    def apply_batch(self, batch: TokenBatch) -> TokenBatch:
+        """ Applica la funzione di perturbazione a tutti i testi di un lotto, con un solo passaggio sulla lista piatta dei token.
+        I gruppi sono formati all'interno di ogni testo, come in `apply`, ma i gruppi da perturbare sono estratti in un'unica sequenza per tutto il lotto:
+        il risultato è diverso da quello di `apply` su ogni testo, a parità di seed
+
+        Args:
+            batch(`TokenBatch`): lotto di testi da perturbare
+        """
+        return self.apply_batch_counted(batch)[0]
+
+    def apply_batch_counted(self, batch: TokenBatch) -> tuple:
+        """ Come `apply_batch`, ma ritorna anche il numero di gruppi di token perturbati """
+        group_size = self.token_grouping
+        tokens, offsets = batch.tokens, batch.offsets
+        # Indice del primo gruppo di ogni testo, nella numerazione dei gruppi di tutto il lotto
+        if group_size == 1:
+            group_offsets = offsets
+        else:
+            group_offsets = [0]
+            for start, end in zip(offsets, offsets[1:]):
+                group_offsets.append(group_offsets[-1] +
+                                     (end - start + group_size - 1) //
+                                     group_size)
+        perturbed_list = []
+        new_offsets = [0]
+        copied = 0
+        perturbed_groups = 0
+        # Testo che contiene il gruppo estratto: b - 1
+        b = 1
+        for i in bernoulli_hits(group_offsets[-1], self.probability):
+            while group_offsets[b] <= i:
+                new_offsets.append(offsets[b] + len(perturbed_list) - copied)
+                b += 1
+            start = offsets[b - 1] + (i - group_offsets[b - 1]) * group_size
+            if start + group_size > offsets[b]:
+                continue
+            perturbed_list.extend(tokens[copied:start])
+            perturbed_list.extend(
+                self.perturbation_function(tokens[start:start + group_size]))
+            copied = start + group_size
+            perturbed_groups += 1
+        if not copied:
+            return batch, 0
+        growth = len(perturbed_list) - copied
+        perturbed_list.extend(tokens[copied:])
+        new_offsets.extend(o + growth for o in offsets[b:])
+        return TokenBatch(perturbed_list, new_offsets), perturbed_groups
+
+    def apply_batch_profiled(self, batch: TokenBatch, profiler,
+                             position: int) -> TokenBatch:
+        """ Come `apply_batch`, registrando tempo e contatori del modulo in `profiler` """
+        start = time.perf_counter()
+        perturbed, groups = self.apply_batch_counted(batch)
+        profiler.module(position,
+                        self.name,
+                        time.perf_counter() - start,
+                        tokens_in=len(batch.tokens),
+                        tokens_out=len(perturbed.tokens),
+                        groups=groups)
+        return perturbed
+
+
+class FusedModule:
+    """ Modulo che applica in serie più `PerturbationModule` con token_grouping=1, senza ricopiare tutta la lista dei token dopo ogni modulo.
+    I token sono tenuti in una tabella di pezzi: intervalli della lista originale e liste di token già perturbati. La lista finale è costruita una volta sola.
+    Ogni modulo sceglie i token da perturbare e consuma i numeri random nello stesso ordine di `PerturbationModule.apply`, quindi il risultato è identico a quello dei moduli applicati uno alla volta """
+    def __init__(self, modules: list) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            modules(`list(PerturbationModule)`): moduli da unire, tutti con token_grouping=1
+        """
+        self.modules = modules
+
+    def apply(self, tokens: list) -> list:
+        """ Funzione che prende in input una lista di token e applica in serie tutti i moduli uniti
+
+        Args:
+            tokens: lista di token da perturbare
+        """
+        # Un pezzo è una tupla (inizio, fine) sulla lista originale oppure una lista di token
+        pieces = [(0, len(tokens))]
+        length = len(tokens)
+        for module in self.modules:
+            pieces, length, _, _ = self.apply_module(module, tokens, pieces,
+                                                     length)
+        return self.join(tokens, pieces)
+
+    def apply_profiled(self, tokens: list, profiler, position: int) -> list:
+        """ Come `apply`, registrando in `profiler` tempo e contatori di ognuno dei moduli uniti, nelle posizioni a partire da `position`.
+        La costruzione della lista finale è registrata a parte, come modulo `FusedModule` """
+        pieces = [(0, len(tokens))]
+        length = len(tokens)
+        for i, module in enumerate(self.modules):
+            start = time.perf_counter()
+            tokens_in = length
+            pieces, length, groups, _ = self.apply_module(
+                module, tokens, pieces, length)
+            profiler.module(position + i,
+                            module.name,
+                            time.perf_counter() - start,
+                            tokens_in=tokens_in,
+                            tokens_out=length,
+                            groups=groups)
+        start = time.perf_counter()
+        perturbed_list = self.join(tokens, pieces)
+        profiler.module(position, "FusedModule", time.perf_counter() - start)
+        return perturbed_list
+
+    def apply_batch(self, batch: TokenBatch) -> TokenBatch:
+        """ Applica in serie tutti i moduli uniti ai testi di un lotto, con una sola tabella dei pezzi sulla lista piatta dei token (vedi `PerturbationModule.apply_batch`)
+
+        Args:
+            batch(`TokenBatch`): lotto di testi da perturbare
+        """
+        tokens, offsets = batch.tokens, batch.offsets
+        pieces = [(0, len(tokens))]
+        length = len(tokens)
+        for module in self.modules:
+            pieces, length, _, offsets = self.apply_module(
+                module, tokens, pieces, length, offsets)
+        return TokenBatch(self.join(tokens, pieces), offsets)
+
+    def apply_batch_profiled(self, batch: TokenBatch, profiler,
+                             position: int) -> TokenBatch:
+        """ Come `apply_batch`, registrando in `profiler` le misure di ognuno dei moduli uniti, come `apply_profiled` """
+        tokens, offsets = batch.tokens, batch.offsets
+        pieces = [(0, len(tokens))]
+        length = len(tokens)
+        for i, module in enumerate(self.modules):
+            start = time.perf_counter()
+            tokens_in = length
+            pieces, length, groups, offsets = self.apply_module(
+                module, tokens, pieces, length, offsets)
+            profiler.module(position + i,
+                            module.name,
+                            time.perf_counter() - start,
+                            tokens_in=tokens_in,
+                            tokens_out=length,
+                            groups=groups)
+        start = time.perf_counter()
+        perturbed = TokenBatch(self.join(tokens, pieces), offsets)
+        profiler.module(position, "FusedModule", time.perf_counter() - start)
+        return perturbed
+
+    def join(self, tokens: list, pieces: list) -> list:
+        """ Costruisce la lista dei token dalla tabella dei pezzi """
+        perturbed_list = []
+        for piece in pieces:
+            if type(piece) is tuple:
+                perturbed_list.extend(tokens[piece[0]:piece[1]])
+            else:
+                perturbed_list.extend(piece)
+        return perturbed_list
+
+    def apply_module(self,
+                     module: PerturbationModule,
+                     tokens: list,
+                     pieces: list,
+                     length: int,
+                     offsets: list = None):
+        """ Applica un modulo alla tabella dei pezzi, ritornando la nuova tabella, il nuovo numero di token, il numero di token perturbati e
+        le nuove posizioni `offsets` dei testi di un lotto (vedi `TokenBatch`), oppure None se `offsets` non è dato """
+        new_pieces = []
+        new_offsets = [0]
+        length_in = length
+        hits = 0
+        j = 0
+        b = 1
+        # Indice (nei token in ingresso al modulo) del primo token di pieces[j]
+        offset = 0
+        for hit in bernoulli_hits(length, module.probability):
+            if offsets is not None:
+                while offsets[b] <= hit:
+                    new_offsets.append(offsets[b] + length - length_in)
+                    b += 1
+            while offset + piece_length(pieces[j]) <= hit:
+                if piece_length(pieces[j]):
+                    new_pieces.append(pieces[j])
+                offset += piece_length(pieces[j])
+                j += 1
+            piece = pieces[j]
+            k = hit - offset
+            if type(piece) is tuple:
+                start, end = piece
+                token = tokens[start + k]
+                left, right = (start, start + k), (start + k + 1, end)
+            else:
+                token = piece[k]
+                left, right = piece[:k], piece[k + 1:]
+            if piece_length(left):
+                new_pieces.append(left)
+            perturbed = module.perturbation_function([token])
+            new_pieces.append(perturbed)
+            length += len(perturbed) - 1
+            pieces[j] = right
+            offset = hit + 1
+            hits += 1
+        new_pieces.extend(p for p in pieces[j:] if piece_length(p))
+        if offsets is None:
+            return new_pieces, length, hits, None
+        new_offsets.extend(o + length - length_in for o in offsets[b:])
+        return new_pieces, length, hits, new_offsets
+
+
+def piece_length(piece) -> int:
+    """ Numero di token in un pezzo della tabella di `FusedModule` """
+    if type(piece) is tuple:
+        return piece[1] - piece[0]
+    return len(piece)
 
 
 class TokenizerModule:
     """ Modulo che si occupa della tokenizzazione """
+    def __init__(self, backend: str = "regex") -> None:
+        """ Costruttore base della classe
+
+        Args:
+            backend(`str`, optional): backend di tokenizzazione (vedi utils/tokenizer_backends.py). "regex" è il default veloce, "nltk" usa `nltk.word_tokenize` ed è l'implementazione di riferimento
+        """
+        self.backend = backend
+        self.word_tokenizer = get_tokenizer(backend)
+
+    def key(self) -> tuple:
+        """ Chiave che identifica il tipo di tokenizzazione: moduli con la stessa chiave producono gli stessi token """
+        return (type(self), self.backend)
+
     def apply(self, input: str) -> list:
         """ Funzione che tokenizza la stringa data in input 
         
         Args:
             input(:obj:`str`): stringa da tokenizzare
         """
-        return word_tokenize(input)
+        return self.word_tokenizer.tokenize(input)
+
+    def apply_profiled(self, input: str, profiler, position: int) -> list:
+        """ Come `apply`, registrando in `profiler` il tempo, i caratteri in ingresso e i token prodotti """
+        start = time.perf_counter()
+        tokens = self.apply(input)
+        profiler.module(position,
+                        f"TokenizerModule({self.backend})",
+                        time.perf_counter() - start,
+                        chars_in=len(input),
+                        tokens_out=len(tokens))
+        return tokens
+
+    def apply_batch(self, inputs: list) -> TokenBatch:
+        """ Tokenizza le stringhe di un lotto, ritornando i token in un `TokenBatch`
+
+        Args:
+            inputs(:obj:`list(str)`): stringhe da tokenizzare
+        """
+        tokenize = self.word_tokenizer.tokenize
+        tokens = []
+        offsets = [0]
+        for input in inputs:
+            tokens.extend(tokenize(input))
+            offsets.append(len(tokens))
+        return TokenBatch(tokens, offsets)
+
+    def apply_batch_profiled(self, inputs: list, profiler,
+                             position: int) -> TokenBatch:
+        """ Come `apply_batch`, registrando in `profiler` il tempo, i caratteri in ingresso e i token prodotti """
+        start = time.perf_counter()
+        batch = self.apply_batch(inputs)
+        profiler.module(position,
+                        f"TokenizerModule({self.backend})",
+                        time.perf_counter() - start,
+                        chars_in=sum(len(i) for i in inputs),
+                        tokens_out=len(batch.tokens))
+        return batch
 
 
 class DetokenizerModule:
@@ -79,6 +429,55 @@ class DetokenizerModule:
         """
         return detokenize(input)
 
+    def apply_profiled(self, input: list, profiler, position: int) -> str:
+        """ Come `apply`, registrando in `profiler` il tempo, i token in ingresso e i caratteri prodotti """
+        start = time.perf_counter()
+        output = self.apply(input)
+        profiler.module(position,
+                        "DetokenizerModule",
+                        time.perf_counter() - start,
+                        tokens_in=len(input),
+                        chars_out=len(output))
+        return output
+
+    def apply_many(self, inputs) -> list:
+        """ Detokenizza più liste di token, con lo stesso risultato di `apply` su ognuna
+
+        Args:
+            inputs(:obj:`iterable(list(str))`): liste di token da detokenizzare
+        """
+        return detokenize_many(inputs)
+
+    def apply_iter(self, blocks):
+        """ Generatore che detokenizza un testo dato a blocchi di token, un pezzo alla volta. I pezzi uniti sono uguali ad `apply` su tutti i token (vedi `detokenize_stream`)
+
+        Args:
+            blocks(:obj:`iterable(list(str))`): blocchi di token, nell'ordine del testo
+        """
+        return detokenize_stream(blocks)
+
+    def apply_batch(self, batch: TokenBatch) -> list:
+        """ Detokenizza i testi di un lotto, ritornando una stringa per testo
+
+        Args:
+            batch(`TokenBatch`): lotto di testi da detokenizzare
+        """
+        tokens, offsets = batch.tokens, batch.offsets
+        return detokenize_many(tokens[start:end]
+                               for start, end in zip(offsets, offsets[1:]))
+
+    def apply_batch_profiled(self, batch: TokenBatch, profiler,
+                             position: int) -> list:
+        """ Come `apply_batch`, registrando in `profiler` il tempo, i token in ingresso e i caratteri prodotti """
+        start = time.perf_counter()
+        outputs = self.apply_batch(batch)
+        profiler.module(position,
+                        "DetokenizerModule",
+                        time.perf_counter() - start,
+                        tokens_in=len(batch.tokens),
+                        chars_out=sum(len(o) for o in outputs))
+        return outputs
+
 
 def split(token: str) -> str:
     """ Funzione spezzetta un token aggiungendo spazi fra le lettere """
@@ -96,7 +495,8 @@ def SplitModuleGenerator(probability: float) -> PerturbationModule:
     """
     return PerturbationModule(perturbation_function=split_tokens,
                               token_grouping=1,
-                              probability=probability)
+                              probability=probability,
+                              name="SplitModule")
 
 
 def AddPunctuationModule(probability: float,
@@ -106,7 +506,8 @@ def AddPunctuationModule(probability: float,
     return PerturbationModule(
         perturbation_function=lambda tokens: [*tokens, punctChar],
         token_grouping=1,
-        probability=probability)
+        probability=probability,
+        name=f"AddPunctuationModule({punctChar!r})")
 
 
 def MergeWordHyphenModule(probability: float) -> PerturbationModule:
@@ -114,7 +515,8 @@ def MergeWordHyphenModule(probability: float) -> PerturbationModule:
     return PerturbationModule(
         perturbation_function=lambda tokens: [f"{tokens[0]}-{tokens[1]}"],
         token_grouping=2,
-        probability=probability)
+        probability=probability,
+        name="MergeWordHyphenModule")
 
 
 def addComma(token, punctChar):
@@ -136,27 +538,40 @@ def SplitWithCommaModule(probability: float,
     return PerturbationModule(perturbation_function=lambda tokens:
                               [addComma(t, punctChar) for t in tokens],
                               token_grouping=1,
-                              probability=probability)
+                              probability=probability,
+                              name=f"SplitWithCommaModule({punctChar!r})")
 
 
-def replaceChars(token: str, subData: dict) -> str:
+def replaceChars(token: str, subData) -> str:
     """ Funzione che perturba un token sostituiendo un uno o più caratteri con una stringa presa dall matrice di sostituzione """
-    subProb = subData["count"]
-    subMatrix = subData["subs"]
-    appliable = {k: subProb[k] for k in subProb.keys() if k in token}
-    subCandidates = list(appliable.keys())
+    matrix = compile_matrix(subData)
+    occurrences = matrix.occurrences(token)
+    subCandidates = list(occurrences.keys())
     shuffle(subCandidates)
-    tokenBitMask = [0 for char in token]
+    # Intervalli del token originale già sostituiti, disgiunti e ordinati per inizio
+    starts, ends, replacements = [], [], []
     for sub in subCandidates:
-        subProb = appliable[sub]
-        subWith = weighted_choice(subMatrix[sub])
-        for start in find_all(token, sub):
-            if sum(tokenBitMask[start:start + len(sub)]
-                   ) == 0 and probability_boolean(subProb):
-                token = token[:start] + subWith + token[start + len(sub):]
-                tokenBitMask = tokenBitMask[:start] + \
-                    [1 for c in subWith] + tokenBitMask[start+len(sub):]
-    return token
+        subProb = matrix.count[sub]
+        subWith = weighted_choice(matrix.samplers[sub])
+        for start in occurrences[sub]:
+            end = start + len(sub)
+            i = bisect_right(starts, start)
+            overlaps = (i > 0 and ends[i - 1] > start) or (i < len(starts)
+                                                           and starts[i] < end)
+            if not overlaps and probability_boolean(subProb):
+                starts.insert(i, start)
+                ends.insert(i, end)
+                replacements.insert(i, subWith)
+    if not starts:
+        return token
+    pieces = []
+    previous_end = 0
+    for start, end, subWith in zip(starts, ends, replacements):
+        pieces.append(token[previous_end:start])
+        pieces.append(subWith)
+        previous_end = end
+    pieces.append(token[previous_end:])
+    return "".join(pieces)
 
 
 def replaceChars_Tokens(tokens, subData):
@@ -167,22 +582,26 @@ def replaceChars_Tokens(tokens, subData):
 def CharsSubModule(subMatrix: dict,
                    probability: int = 1) -> PerturbationModule:
     """ Funzione che genera moduli di sostituzione caratteri. Sono una necessarie la matrice di sostituizone e la probabilità """
+    subMatrix = compile_matrix(subMatrix)
     return PerturbationModule(perturbation_function=lambda tokens:
                               replaceChars_Tokens(tokens, subMatrix),
                               token_grouping=1,
-                              probability=probability)
+                              probability=probability,
+                              name="CharsSubModule")
 
 
 def generate_alternatives_for(token: str, subData: dict,
                               alternativesDict: dict, tokenAlternatives: int):
-    """ Genera le n alternative per un certo token """
+    """ Genera le n alternative per un certo token.
+    Le alternative dipendono solo dal token, così il loro valore non cambia a seconda dell'ordine in cui i token sono incontrati """
     altList = []
     i = 0
-    while (len(altList) < tokenAlternatives and i < 50):
-        i += 1
-        t = replaceChars(token, subData)
-        if t not in altList:
-            altList.append(t)
+    with seeded(derive_seed("alternatives", token)):
+        while (len(altList) < tokenAlternatives and i < 50):
+            i += 1
+            t = replaceChars(token, subData)
+            if t not in altList:
+                altList.append(t)
     alternativesDict[token] = altList
     return altList
 
@@ -210,20 +629,27 @@ def replace_tokens(tokens, subData, alternativesDict, tokenAlternatives: int):
 
 def TokenSubModule(subMatrix,
                    tokenAlternatives=5,
-                   alternativesDict={},
+                   alternativesDict=None,
                    probability=1):
-    """ Funzione che  crea moduli di sostituzione token. E' come il modulo di sostituzione caratteri, ma le parole sostituibili con un certo token sono predeterminate ad un numero di alternative `tokenAlternarives` """
+    """ Funzione che  crea moduli di sostituzione token. E' come il modulo di sostituzione caratteri, ma le parole sostituibili con un certo token sono predeterminate ad un numero di alternative `tokenAlternarives`.
+    Le alternative sono conservate in `alternativesDict` (un dizionario o una `AlternativesCache`); se non è fornito, il modulo usa una propria `AlternativesCache` """
+    subMatrix = compile_matrix(subMatrix)
+    if alternativesDict is None:
+        alternativesDict = AlternativesCache()
     return PerturbationModule(
         perturbation_function=lambda tokens: replace_tokens(
             tokens, subMatrix, alternativesDict, tokenAlternatives),
         token_grouping=1,
-        probability=probability)
+        probability=probability,
+        name="TokenSubModule")
 
 
 class Pipeline:
     """ Classe che modella una pipeline di pertubazione """
     def __init__(self):
         self.modules = []
+        self._compiled = []
+        self._compiled_for = None
 
     def addModule(self, module: PerturbationModule):
         """ Aggiunge un modulo alla pipeline.
@@ -243,10 +669,117 @@ class Pipeline:
         Args:
             input(`list(str)`): lista di token da perturbare
         """
-        for module in self.modules:
+        modules = self.compile()
+        if instrumentation.active is not None:
+            return self.run_profiled(modules, input, instrumentation.active)
+        for module in modules:
             input = module.apply(input)
         return input
 
+    def run_profiled(self,
+                     modules: list,
+                     input,
+                     profiler,
+                     position: int = 0):
+        """ Applica i moduli compilati `modules` registrando in `profiler` le misure di ognuno (vedi instrumentation.py)
+
+        Args:
+            modules(`list`): moduli compilati da applicare, come ritornati da `compile`
+            input: testo o lista di token da perturbare
+            profiler(`Profiler`): profiler attivo
+            position(`int`): posizione nella pipeline del primo modulo
+        """
+        for module in modules:
+            input = module.apply_profiled(input, profiler, position)
+            if isinstance(module, FusedModule):
+                position += len(module.modules)
+            else:
+                position += 1
+        return input
+
+    def compile(self) -> list:
+        """ Ritorna i moduli della pipeline pronti per l'esecuzione: le sequenze di due o più `PerturbationModule` consecutivi con token_grouping=1 sono unite in un `FusedModule`.
+        Il risultato è ricalcolato solo quando i moduli della pipeline cambiano """
+        if self._compiled_for != self.modules:
+            compiled = []
+            fusable = []
+            for module in [*self.modules, None]:
+                if isinstance(module, PerturbationModule
+                              ) and module.token_grouping == 1:
+                    fusable.append(module)
+                    continue
+                if len(fusable) > 1:
+                    compiled.append(FusedModule(fusable))
+                else:
+                    compiled.extend(fusable)
+                fusable = []
+                if module is not None:
+                    compiled.append(module)
+            self._compiled = compiled
+            self._compiled_for = list(self.modules)
+        return self._compiled
+
+    def tokenizer(self):
+        """ Ritorna il modulo di tokenizzazione con cui inizia la pipeline, oppure None """
+        if self.modules and isinstance(self.modules[0], TokenizerModule):
+            return self.modules[0]
+        return None
+
+    def run_tokenized(self, tokens: list) -> list:
+        """ Come `run`, ma su un testo già tokenizzato: il modulo di tokenizzazione iniziale della pipeline viene saltato
+
+        Args:
+            tokens(`list(str)`): lista di token da perturbare
+        """
+        modules = self.compile()
+        position = 0
+        if self.tokenizer():
+            modules = modules[1:]
+            position = 1
+        if instrumentation.active is not None:
+            return self.run_profiled(modules, tokens, instrumentation.active,
+                                     position)
+        for module in modules:
+            tokens = module.apply(tokens)
+        return tokens
+
+    def run_batch(self, inputs: list) -> list:
+        """ Perturba più testi insieme: ogni modulo è applicato a tutto il lotto prima di passare al successivo, con i token di tutti i testi in un'unica lista (vedi `TokenBatch`).
+        A parità di seed il risultato è diverso da quello di `run` su ogni testo, perché i numeri random sono estratti modulo per modulo su tutto il lotto
+
+        Args:
+            inputs(`list`): stringhe da perturbare, oppure liste di token se la pipeline non inizia con un modulo di tokenizzazione
+        """
+        batch = inputs if self.tokenizer() else TokenBatch.from_lists(inputs)
+        output = self.apply_batch(batch)
+        if isinstance(output, TokenBatch):
+            return output.to_lists()
+        return output
+
+    def apply_batch(self, batch, tokenized: bool = False):
+        """ Applica i moduli della pipeline a un lotto, ritornando il lotto prodotto dall'ultimo modulo (un `TokenBatch`, o una lista di stringhe se la pipeline finisce con un modulo di detokenizzazione)
+
+        Args:
+            batch: lista di stringhe, oppure `TokenBatch` se la pipeline non inizia con un modulo di tokenizzazione o se `tokenized` è True
+            tokenized(`bool`): se True, `batch` è già tokenizzato e il modulo di tokenizzazione iniziale della pipeline viene saltato
+        """
+        modules = self.compile()
+        position = 0
+        if tokenized and self.tokenizer():
+            modules = modules[1:]
+            position = 1
+        profiler = instrumentation.active
+        for module in modules:
+            if profiler is None:
+                batch = module.apply_batch(batch)
+            else:
+                batch = module.apply_batch_profiled(batch, profiler, position)
+            if isinstance(module, FusedModule):
+                position += len(module.modules)
+            else:
+                position += 1
+        return batch
+
     def concatPipeline(self, other):
         """ Aggiunge alla pipeline tutti i modi dell'altra pipeline
         
@@ -312,37 +845,333 @@ class SuperPipeline:
         index = len(self.sub_pipelines) - 1
         self.sub_pipelines_weights.extend([index] * weight)
 
+    def block_spans(self, input: str):
+        """ Generatore che divide la stringa `input` in blocchi di almeno `self.block_size` caratteri, tagliando al primo spazio successivo.
+        Ritorna le coppie (inizio, fine) dei blocchi, senza copiare il testo; lo spazio su cui si taglia resta fra un blocco e l'altro
+        
+        Args:
+            input (:obj:`str`): stringa da dividere in blocchi
+        """
+        start = 0
+        while True:
+            cut = input.find(" ", start + self.block_size)
+            if cut == -1:
+                yield (start, len(input))
+                return
+            yield (start, cut)
+            start = cut + 1
+
+    def iter_blocks(self, input: str):
+        """ Generatore dei blocchi di `input`, come stringhe
+
+        Args:
+            input (:obj:`str`): stringa da dividere in blocchi
+        """
+        for start, end in self.block_spans(input):
+            yield input[start:end]
+
     def splitted(self, input: str) -> list:
         """ Funzione che ritorna la stringa `input` in blocchi di `self.block_size` caratteri 
         
         Args:
             input (:obj:`str`): stringa da dividere in blocchi
         """
-        blocks = []
-        bufferStr = ""
-        for char in input:
-            if len(bufferStr) < self.block_size or (
-                    len(bufferStr) >= self.block_size and char != " "):
-                bufferStr += char
-            else:
-                blocks.append(bufferStr)
-                bufferStr = ""
-        blocks.append(bufferStr)
+        return list(self.iter_blocks(input))
+
+    def tokenization_key(self):
+        """ Ritorna una chiave che identifica come la superpipeline divide e tokenizza il testo, oppure None se le sue pipeline non iniziano tutte con lo stesso tipo di tokenizzazione.
+        Superpipeline con la stessa chiave possono condividere i blocchi già tokenizzati """
+        tokenizers = [p.tokenizer() for p in self.sub_pipelines]
+        if not tokenizers or any(t is None for t in tokenizers):
+            return None
+        kinds = {t.key() for t in tokenizers}
+        if len(kinds) > 1:
+            return None
+        return (self.block_size, *kinds.pop())
+
+    def tokenized_blocks(self, input: str) -> list:
+        """ Divide la stringa `input` in blocchi e li tokenizza, con il tokenizzatore delle pipeline della superpipeline
+
+        Args:
+            input (:obj:`str`): stringa da dividere e tokenizzare
+        """
+        tokenizer = self.sub_pipelines[0].tokenizer()
+        profiler = instrumentation.active
+        if profiler is None:
+            return [tokenizer.apply(b) for b in self.iter_blocks(input)]
+        start = time.perf_counter()
+        blocks = [tokenizer.apply(b) for b in self.iter_blocks(input)]
+        profiler.stage("tokenizer",
+                       time.perf_counter() - start,
+                       chars_in=len(input),
+                       tokens_out=sum(len(b) for b in blocks))
         return blocks
 
+    def run_tokenized(self, blocks: list) -> str:
+        """ Perturba un testo già diviso in blocchi e tokenizzato con `tokenized_blocks`. Il risultato è lo stesso di `run` sul testo originale
+
+        Args:
+            blocks (:obj:`list(list(str))`): blocchi di token da perturbare
+        """
+        return self._run_blocks(blocks, tokenized=True)
+
+    def perturbed_blocks(self, blocks, tokenized: bool):
+        """ Generatore dei blocchi perturbati, ognuno con la pipeline scelta per il blocco. La pipeline cambia da un blocco all'altro con probabilità 1 - `self.stickyness`
+
+        Args:
+            blocks: blocchi di testo da perturbare, oppure blocchi di token se `tokenized` è True
+            tokenized (:obj:`bool`): se True, i blocchi sono già tokenizzati
+        """
+        profiler = instrumentation.active
+        current_pipeline = random_choice(self.sub_pipelines_weights)
+        for pb in blocks:
+            if not probability_boolean(self.stickyness):
+                current_pipeline = random_choice(self.sub_pipelines_weights)
+            if profiler is not None:
+                profiler.choose(current_pipeline)
+            pipeline = self.sub_pipelines[current_pipeline]
+            if tokenized:
+                yield pipeline.run_tokenized(pb)
+            else:
+                yield pipeline.run(pb)
+
+    def _run_blocks(self, blocks: list, tokenized: bool) -> str:
+        profiler = instrumentation.active
+        perturbed_blocks = list(
+            chain.from_iterable(self.perturbed_blocks(blocks, tokenized)))
+        if profiler is None:
+            return self.detokenizer.apply(perturbed_blocks)
+        start = time.perf_counter()
+        output = self.detokenizer.apply(perturbed_blocks)
+        profiler.stage("detokenizer",
+                       time.perf_counter() - start,
+                       tokens_in=len(perturbed_blocks),
+                       chars_out=len(output))
+        return output
+
     def run(self, input: str) -> str:
         """ Funzione che perturba in testo `input` con la Superpipeline definta 
         
         Args:
             input (:obj:`str`): stringa da perturbare
         """
-        plain_blocks = self.splitted(input)
-        perturbed_blocks = []
-        current_pipeline = random_choice(self.sub_pipelines_weights)
-        for pb in plain_blocks:
-            if not probability_boolean(self.stickyness):
-                current_pipeline = random_choice(self.sub_pipelines_weights)
-            perturbed = self.sub_pipelines[current_pipeline].run(pb)
-            perturbed_blocks.append(perturbed)
-        perturbed_blocks = list(chain(*perturbed_blocks))
-        return self.detokenizer.apply(perturbed_blocks)
+        return self._run_blocks(self.iter_blocks(input), tokenized=False)
+
+    def run_iter(self, input: str):
+        """ Generatore che perturba il testo `input` un blocco alla volta, producendo il testo perturbato a pezzi.
+        In memoria ci sono solo il blocco corrente e i token non ancora detokenizzati: i pezzi uniti sono uguali al risultato di `run` con lo stesso seed
+
+        Args:
+            input (:obj:`str`): stringa da perturbare
+        """
+        return self.detokenizer.apply_iter(
+            self.perturbed_blocks(self.iter_blocks(input), tokenized=False))
+
+    def stream_blocks(self, chunks):
+        """ Come `iter_blocks`, ma su un testo letto a pezzi (ad esempio da un file): i blocchi sono gli stessi, e del testo è tenuto in memoria solo il blocco corrente
+
+        Args:
+            chunks (:obj:`iterable(str)`): pezzi consecutivi del testo
+        """
+        buffer = ""
+        # Nel buffer non ci sono spazi da dove inizia il blocco (+ block_size) fino a `searched`
+        searched = self.block_size
+        for chunk in chunks:
+            buffer += chunk
+            while True:
+                cut = buffer.find(" ", searched)
+                if cut == -1:
+                    searched = max(self.block_size, len(buffer))
+                    break
+                yield buffer[:cut]
+                buffer = buffer[cut + 1:]
+                searched = self.block_size
+        yield buffer
+
+    def run_file(self,
+                 input_filename: str,
+                 output_filename: str,
+                 chunk_size: int = 2**16) -> None:
+        """ Perturba il contenuto del file `input_filename` e lo scrive in `output_filename`, un blocco alla volta (vedi `run_iter`), senza leggere tutto il file in memoria.
+        Il file scritto contiene il risultato di `run` sul contenuto del file, a parità di seed
+
+        Args:
+            input_filename (:obj:`str`): file da perturbare
+            output_filename (:obj:`str`): file in cui scrivere il testo perturbato
+            chunk_size (:obj:`int`, optional): numero di caratteri letti alla volta
+        """
+        with open(input_filename) as fin, open(output_filename, "w") as fout:
+            chunks = iter(lambda: fin.read(chunk_size), "")
+            blocks = self.perturbed_blocks(self.stream_blocks(chunks),
+                                           tokenized=False)
+            for piece in self.detokenizer.apply_iter(blocks):
+                fout.write(piece)
+
+    def batch_blocks(self, inputs: list) -> tuple:
+        """ Divide in blocchi tutti i testi di un lotto. Ritorna la lista dei blocchi e la posizione nella lista del primo blocco di ogni testo, seguita dal numero totale di blocchi
+
+        Args:
+            inputs (:obj:`list(str)`): stringhe da dividere in blocchi
+        """
+        blocks = []
+        block_offsets = [0]
+        for input in inputs:
+            blocks.extend(self.iter_blocks(input))
+            block_offsets.append(len(blocks))
+        return blocks, block_offsets
+
+    def tokenized_batch_blocks(self, inputs: list) -> tuple:
+        """ Come `batch_blocks`, ma i blocchi sono tokenizzati insieme, in un `TokenBatch`, con il tokenizzatore delle pipeline della superpipeline """
+        blocks, block_offsets = self.batch_blocks(inputs)
+        tokenizer = self.sub_pipelines[0].tokenizer()
+        profiler = instrumentation.active
+        if profiler is None:
+            return tokenizer.apply_batch(blocks), block_offsets
+        start = time.perf_counter()
+        batch = tokenizer.apply_batch(blocks)
+        profiler.stage("tokenizer",
+                       time.perf_counter() - start,
+                       chars_in=sum(len(i) for i in inputs),
+                       tokens_out=len(batch.tokens))
+        return batch, block_offsets
+
+    def run_batch(self, inputs: list) -> list:
+        """ Perturba più testi insieme. Ogni pipeline perturba in un solo lotto (vedi `Pipeline.run_batch`) tutti i blocchi per cui è stata scelta, di tutti i testi.
+        A parità di seed il risultato è diverso da quello di `run` su ogni testo: le pipeline sono scelte per tutti i testi prima di perturbarli
+
+        Args:
+            inputs (:obj:`list(str)`): stringhe da perturbare
+        """
+        if self.tokenization_key() is None:
+            blocks, block_offsets = self.batch_blocks(inputs)
+            return self.run_batch_blocks(blocks, block_offsets, tokenized=False)
+        batch, block_offsets = self.tokenized_batch_blocks(inputs)
+        return self.run_batch_blocks(batch, block_offsets, tokenized=True)
+
+    def run_batch_blocks(self, blocks, block_offsets: list,
+                         tokenized: bool) -> list:
+        """ Perturba i blocchi di un lotto di testi, divisi con `batch_blocks` o `tokenized_batch_blocks`. Ritorna un testo perturbato per ogni testo del lotto
+
+        Args:
+            blocks: lista dei blocchi, oppure `TokenBatch` dei blocchi se `tokenized` è True
+            block_offsets (:obj:`list(int)`): posizione del primo blocco di ogni testo, come ritornata da `batch_blocks`
+            tokenized (:obj:`bool`): se True, i blocchi sono già tokenizzati
+        """
+        profiler = instrumentation.active
+        # Pipeline scelta per ogni blocco, con le stesse regole di `run`
+        choices = []
+        for start, end in zip(block_offsets, block_offsets[1:]):
+            current_pipeline = random_choice(self.sub_pipelines_weights)
+            for _ in range(start, end):
+                if not probability_boolean(self.stickyness):
+                    current_pipeline = random_choice(
+                        self.sub_pipelines_weights)
+                if profiler is not None:
+                    profiler.choose(current_pipeline)
+                choices.append(current_pipeline)
+        # Per ogni blocco, il lotto perturbato che lo contiene e la sua posizione nel lotto
+        perturbed = [None] * len(choices)
+        for index, pipeline in enumerate(self.sub_pipelines):
+            selected = [i for i, c in enumerate(choices) if c == index]
+            if not selected:
+                continue
+            if tokenized:
+                output = pipeline.apply_batch(blocks.select(selected),
+                                              tokenized=True)
+            else:
+                output = pipeline.run_batch([blocks[i] for i in selected])
+            if not isinstance(output, TokenBatch):
+                output = TokenBatch.from_lists(output)
+            for position, i in enumerate(selected):
+                perturbed[i] = (output, position)
+        tokens = []
+        offsets = [0]
+        for start, end in zip(block_offsets, block_offsets[1:]):
+            for output, position in perturbed[start:end]:
+                tokens.extend(output[position])
+            offsets.append(len(tokens))
+        output_batch = TokenBatch(tokens, offsets)
+        if profiler is None:
+            return self.detokenizer.apply_batch(output_batch)
+        start = time.perf_counter()
+        outputs = self.detokenizer.apply_batch(output_batch)
+        profiler.stage("detokenizer",
+                       time.perf_counter() - start,
+                       tokens_in=len(tokens),
+                       chars_out=sum(len(o) for o in outputs))
+        return outputs
+
+
+class SuperPipelineGroup:
+    """ Classe che perturba lo stesso testo con più superpipeline, dividendolo in blocchi e tokenizzandolo una volta sola per tutte quelle che lo dividono e tokenizzano allo stesso modo """
+    def __init__(self, superpipelines: dict) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            superpipelines (:obj:`dict`): dizionario che associa ad ogni nome la sua superpipeline
+        """
+        self.superpipelines = superpipelines
+
+    def run(self, input: str, seeds: dict = None) -> dict:
+        """ Perturba il testo `input` con tutte le superpipeline. Ritorna un dizionario che associa ad ogni nome di superpipeline il testo perturbato
+
+        Args:
+            input (:obj:`str`): stringa da perturbare
+            seeds (:obj:`dict`, optional): se impostato, associa ad ogni nome di superpipeline il seed da impostare prima di usarla
+        """
+        shared_blocks = {}
+        perturbed = {}
+        profiler = instrumentation.active
+        for name, sup in self.superpipelines.items():
+            if seeds is not None:
+                set_seed(seeds[name])
+            if profiler is None:
+                perturbed[name] = self.run_one(sup, input, shared_blocks)
+                continue
+            # La tokenizzazione condivisa è attribuita alla prima superpipeline che la esegue
+            with profiler.section(name):
+                perturbed[name] = self.run_one(sup, input, shared_blocks)
+        return perturbed
+
+    def run_one(self, sup: SuperPipeline, input: str,
+                shared_blocks: dict) -> str:
+        """ Perturba `input` con una superpipeline, riusando (o aggiungendo a `shared_blocks`) i blocchi già tokenizzati con la sua stessa chiave """
+        key = sup.tokenization_key()
+        if key is None:
+            return sup.run(input)
+        if key not in shared_blocks:
+            shared_blocks[key] = sup.tokenized_blocks(input)
+        return sup.run_tokenized(shared_blocks[key])
+
+    def run_batch(self, inputs: list, seeds: dict = None) -> list:
+        """ Perturba più testi insieme con tutte le superpipeline (vedi `SuperPipeline.run_batch`). Ritorna, per ogni testo, il dizionario che associa ad ogni nome di superpipeline il testo perturbato
+
+        Args:
+            inputs (:obj:`list(str)`): stringhe da perturbare
+            seeds (:obj:`dict`, optional): se impostato, associa ad ogni nome di superpipeline il seed da impostare prima di usarla sul lotto
+        """
+        shared_blocks = {}
+        perturbed = [{} for _ in inputs]
+        profiler = instrumentation.active
+        for name, sup in self.superpipelines.items():
+            if seeds is not None:
+                set_seed(seeds[name])
+            if profiler is None:
+                outputs = self.run_batch_one(sup, inputs, shared_blocks)
+            else:
+                with profiler.section(name):
+                    outputs = self.run_batch_one(sup, inputs, shared_blocks)
+            for p, output in zip(perturbed, outputs):
+                p[name] = output
+        return perturbed
+
+    def run_batch_one(self, sup: SuperPipeline, inputs: list,
+                      shared_blocks: dict) -> list:
+        """ Come `run_one`, per un lotto di testi """
+        key = sup.tokenization_key()
+        if key is None:
+            return sup.run_batch(inputs)
+        if key not in shared_blocks:
+            shared_blocks[key] = sup.tokenized_batch_blocks(inputs)
+        batch, block_offsets = shared_blocks[key]
+        return sup.run_batch_blocks(batch, block_offsets, tokenized=True)
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import sys
+
+sys.path.insert(0, "../utils/")
+from aho_corasick import AhoCorasick
+from utils import WeightedSampler
+
+
+class SubstitutionMatrix:
+    """ Versione compilata della matrice degli errori (il contenuto di `error_matrix.json`).
+
+    L'automa sulle chiavi della matrice è costruito una volta sola, in modo da trovare tutte le sottostringhe sostituibili di un token con una sola passata.
+    Allo stesso modo ogni riga della matrice è compilata in un `WeightedSampler`
+    """
+    def __init__(self, subData: dict) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            subData(`dict`): matrice degli errori, con i campi `subs` e `count`
+        """
+        self.subs = subData["subs"]
+        self.count = subData["count"]
+        self.samplers = {
+            key: WeightedSampler(row)
+            for key, row in self.subs.items()
+        }
+        self._fingerprint = None
+        self.build_matcher()
+
+    @classmethod
+    def from_samplers(cls, count: dict, samplers: dict,
+                      fingerprint: str) -> "SubstitutionMatrix":
+        """ Crea la matrice da righe già compilate, senza il dizionario `subs` (ad esempio da un file binario, vedi `error_matrix_binary.py`)
+
+        Args:
+            count(`dict`): probabilità di sostituzione di ogni chiave
+            samplers(`dict`): `WeightedSampler` di ogni chiave
+            fingerprint(`str`): impronta della matrice da cui sono state compilate le righe
+        """
+        matrix = cls.__new__(cls)
+        matrix.subs = None
+        matrix.count = count
+        matrix.samplers = samplers
+        matrix._fingerprint = fingerprint
+        matrix.build_matcher()
+        return matrix
+
+    def build_matcher(self) -> None:
+        """ Costruisce l'automa sulle chiavi della matrice """
+        self.keys = [k for k in self.count.keys() if k]
+        self.matcher = AhoCorasick(self.keys)
+
+    def to_dict(self) -> dict:
+        """ Ritorna la matrice nel formato di `error_matrix.json` """
+        if self.subs is not None:
+            return {"subs": self.subs, "count": self.count}
+        subs = {}
+        for key, sampler in self.samplers.items():
+            row = {}
+            previous = 0
+            for choice, cumulative in zip(sampler.choices,
+                                          sampler.cumulative):
+                row[choice] = cumulative - previous
+                previous = cumulative
+            subs[key] = row
+        return {"subs": subs, "count": dict(self.count)}
+
+    @property
+    def fingerprint(self) -> str:
+        """ Impronta (sha1) del contenuto della matrice, usata per riconoscere i dati derivati da questa matrice """
+        if self._fingerprint is None:
+            content = json.dumps({
+                "subs": self.subs,
+                "count": self.count
+            },
+                                 sort_keys=True)
+            self._fingerprint = hashlib.sha1(
+                content.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    def occurrences(self, token: str) -> dict:
+        """ Ritorna un dizionario che associa ad ogni chiave presente in `token` le posizioni delle sue occorrenze non sovrapposte (le stesse di `find_all`).
+        Le chiavi sono nell'ordine in cui compaiono nella matrice
+
+        Args:
+            token(`str`): token in cui cercare le chiavi
+        """
+        found = {}
+        last_end = {}
+        for start, end, key_index in self.matcher.iter_matches(token):
+            if start >= last_end.get(key_index, 0):
+                last_end[key_index] = end
+                found.setdefault(key_index, []).append(start)
+        keys = self.keys
+        return {keys[i]: found[i] for i in sorted(found)}
+
+
+_compiled = {}
+
+
+def compile_matrix(subData) -> SubstitutionMatrix:
+    """ Ritorna la versione compilata di una matrice degli errori. La compilazione è fatta una volta sola per ogni matrice
+
+    Args:
+        subData(`dict` o `SubstitutionMatrix`): matrice degli errori
+    """
+    if isinstance(subData, SubstitutionMatrix):
+        return subData
+    cached = _compiled.get(id(subData))
+    # Si tiene anche un riferimento al dizionario, così il suo id non può essere riusato
+    if cached is None or cached[0] is not subData:
+        cached = (subData, SubstitutionMatrix(subData))
+        _compiled[id(subData)] = cached
+    return cached[1]
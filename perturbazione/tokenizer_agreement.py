@@ -0,0 +1,109 @@
+""" Confronto fra i backend di tokenizzazione di `TokenizerModule` (vedi utils/tokenizer_backends.py).
+
+Misura quanto i token del backend veloce ("regex") coincidono con quelli di `nltk.word_tokenize` ("nltk") e quanto tempo impiegano i due backend sugli stessi testi.
+
+Uso:
+    python tokenizer_agreement.py [--samples ../creazione_dataset/samples.json] [--limit N] [--repeat 3] [--show 10] [--min-exact 0.99]
+"""
+import argparse
+import json
+import sys
+import time
+from difflib import SequenceMatcher
+
+sys.path.insert(0, "../utils/")
+from tokenizer_backends import get_tokenizer
+
+
+def read_texts(filename: str, limit: int = None) -> list:
+    """ Legge i testi dei sample da un file json (lista di sample) o jsonl (un sample per riga) """
+    with open(filename) as f:
+        if filename.endswith(".jsonl"):
+            samples = [json.loads(line) for line in f if line.strip()]
+        else:
+            samples = json.load(f)
+    return [s["text"] for s in samples[:limit]]
+
+
+def timed(tokenizer, texts: list, repeat: int):
+    """ Tokenizza tutti i testi `repeat` volte. Ritorna i token dell'ultima esecuzione e il tempo migliore """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = [tokenizer.tokenize(t) for t in texts]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return tokens, best
+
+
+def compare(reference: list, candidate: list) -> dict:
+    """ Confronta i token di riferimento con quelli del backend da valutare
+
+    Args:
+        reference(`list(list(str))`): token di riferimento, un elenco per testo
+        candidate(`list(list(str))`): token da valutare, un elenco per testo
+    """
+    exact = 0
+    matched = 0
+    total = 0
+    differences = []
+    for i, (ref, cand) in enumerate(zip(reference, candidate)):
+        total += len(ref) + len(cand)
+        if ref == cand:
+            exact += 1
+            matched += 2 * len(ref)
+            continue
+        matcher = SequenceMatcher(a=ref, b=cand, autojunk=False)
+        matched += 2 * sum(block.size for block in matcher.get_matching_blocks())
+        differences.append((i, [(ref[a1:a2], cand[b1:b2])
+                                for op, a1, a2, b1, b2 in matcher.get_opcodes()
+                                if op != "equal"]))
+    return {
+        "texts": len(reference),
+        "exact": exact / len(reference) if reference else 1.0,
+        "token_agreement": matched / total if total else 1.0,
+        "differences": differences
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Confronta il tokenizzatore regex con nltk.word_tokenize")
+    parser.add_argument("--samples",
+                        default="../creazione_dataset/samples.json")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--show",
+                        type=int,
+                        default=10,
+                        help="numero di differenze da stampare")
+    parser.add_argument(
+        "--min-exact",
+        type=float,
+        default=None,
+        help="termina con errore se la frazione di testi identici è minore")
+    args = parser.parse_args()
+
+    texts = read_texts(args.samples, args.limit)
+    reference, nltk_time = timed(get_tokenizer("nltk"), texts, args.repeat)
+    candidate, regex_time = timed(get_tokenizer("regex"), texts, args.repeat)
+    result = compare(reference, candidate)
+
+    n_tokens = sum(len(t) for t in reference)
+    print(f"Testi: {result['texts']}, token (nltk): {n_tokens}")
+    print(f"Testi tokenizzati in modo identico: {result['exact']:.4%}")
+    print(f"Concordanza sui token: {result['token_agreement']:.4%}")
+    print(f"nltk:  {nltk_time:.3f}s ({n_tokens / nltk_time:,.0f} token/s)")
+    print(f"regex: {regex_time:.3f}s ({n_tokens / regex_time:,.0f} token/s)")
+    print(f"Speedup: {nltk_time / regex_time:.1f}x")
+    for i, ops in result["differences"][:args.show]:
+        print(f"\n[{i}] {texts[i]!r}")
+        for ref, cand in ops:
+            print(f"    nltk {ref} -> regex {cand}")
+
+    if args.min_exact is not None and result["exact"] < args.min_exact:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from collections import deque
+
+
+class AhoCorasick:
+    """ Automa di Aho-Corasick: trova in una sola passata su un testo tutte le occorrenze (anche sovrapposte) di un insieme di chiavi """
+    def __init__(self, keys: list) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            keys(`list(str)`): lista delle chiavi da cercare. Le chiavi vuote sono ignorate
+        """
+        self.keys = [k for k in keys if k]
+        self.key_lengths = [len(k) for k in self.keys]
+        goto = [{}]
+        output = [[]]
+        for key_index, key in enumerate(self.keys):
+            state = 0
+            for char in key:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    output.append([])
+                state = next_state
+            output[state].append(key_index)
+
+        # Visita in ampiezza per calcolare i link di fallimento
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                f = fail[state]
+                while f and char not in goto[f]:
+                    f = fail[f]
+                fail[next_state] = goto[f].get(char, 0)
+                output[next_state].extend(output[fail[next_state]])
+
+        self.goto = goto
+        self.fail = fail
+        self.output = [tuple(o) for o in output]
+
+    def iter_matches(self, text: str):
+        """ Ritorna tutte le occorrenze delle chiavi in `text` come tuple (inizio, fine, indice della chiave), ordinate per posizione di fine
+
+        Args:
+            text(`str`): testo nel quale cercare le chiavi
+        """
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        key_lengths = self.key_lengths
+        state = 0
+        for i, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for key_index in output[state]:
+                yield (i - key_lengths[key_index], i, key_index)
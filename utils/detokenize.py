@@ -1,13 +1,81 @@
+import re
 from nltk.tokenize.treebank import TreebankWordDetokenizer
 
+# Il detokenizzatore non ha stato: se ne usa un'unica istanza
+_detokenizer = TreebankWordDetokenizer()
+
+# Correzioni applicate all'output di Treebank, nell'ordine in cui sono applicate
+FIXES = [(" , ", ", "), (" ' ", "'"), (" ’ ", "’"), (" ’", "’"),
+         (" . ", ". "), (" : ", ": "), (" ; ", "; ")]
+FIXES_TABLE = dict(FIXES)
+FIXES_RE = re.compile(" [,.:;] | ' | ’ ?")
+# Se due correzioni condividono uno spazio, o una correzione crea uno spazio
+# doppio, il risultato dipende dall'ordine: si applicano una alla volta
+CONFLICT_RE = re.compile("[,.:;'’] [,.:;'’]|  ")
+# Parola semplice: lo spazio fra due parole semplici non è toccato da nessuna regola
+WORD_RE = re.compile(r"\w+")
+CONTRACTIONS = _detokenizer.CONTRACTIONS2 + _detokenizer.CONTRACTIONS3
+
+
+def _fix(match):
+    return FIXES_TABLE[match.group()]
+
+
+def fix_spacing(output: str) -> str:
+    """ Applica a `output` le correzioni di `FIXES` con una sola passata, con lo stesso risultato di applicarle una alla volta """
+    if CONFLICT_RE.search(output):
+        for old, new in FIXES:
+            output = output.replace(old, new)
+        return output
+    return FIXES_RE.sub(_fix, output)
+
 
 def detokenize(input):
-    output = TreebankWordDetokenizer().detokenize(input)
-    output = output.replace(" , ", ", ")
-    output = output.replace(" ' ", "'")
-    output = output.replace(" ’ ", "’")
-    output = output.replace(" ’", "’")
-    output = output.replace(" . ", ". ")
-    output = output.replace(" : ", ": ")
-    output = output.replace(" ; ", "; ")
-    return output
+    return fix_spacing(_detokenizer.detokenize(input))
+
+
+def detokenize_many(inputs) -> list:
+    """ Detokenizza più liste di token
+
+    Args:
+        inputs(`iterable(list(str))`): liste di token da detokenizzare
+    """
+    treebank = _detokenizer.detokenize
+    return [fix_spacing(treebank(tokens)) for tokens in inputs]
+
+
+def can_split(left: str, right: str) -> bool:
+    """ Ritorna True se la detokenizzazione di una lista di token che contiene i token consecutivi `left` e `right` si può dividere fra i due:
+    il risultato è la detokenizzazione della parte fino a `left`, uno spazio e la detokenizzazione della parte da `right`.
+    Vale quando le parole che toccano lo spazio fra i due token sono parole semplici e non formano una contrazione """
+    left = left.rpartition(" ")[2]
+    right = right.partition(" ")[0]
+    if not (WORD_RE.fullmatch(left) and WORD_RE.fullmatch(right)):
+        return False
+    pair = f" {left} {right} "
+    return not any(regexp.search(pair) for regexp in CONTRACTIONS)
+
+
+def detokenize_stream(blocks):
+    """ Generatore che detokenizza un testo dato a blocchi di token, producendo il testo un pezzo alla volta.
+    I pezzi uniti sono uguali a `detokenize` di tutti i token: il testo è diviso solo fra token per cui vale `can_split`, e i token dopo l'ultima divisione sono tenuti per il blocco successivo.
+    Per ogni blocco sono controllate solo le coppie di token nuove (i token del blocco, e il primo con l'ultimo token tenuto), quindi il costo è lineare nel numero di token.
+    La memoria è limitata dalla dimensione dei blocchi solo se il testo ha dei punti di divisione: in un tratto senza parole semplici consecutive (ad esempio solo punteggiatura o parole spezzate lettera per lettera) i token sono tenuti finché non se ne trova uno
+
+    Args:
+        blocks(`iterable(list(str))`): blocchi di token, nell'ordine del testo
+    """
+    pending = []
+    separator = ""
+    for block in blocks:
+        # Le coppie di token già in `pending` sono già state controllate
+        checked = max(len(pending), 1)
+        pending.extend(block)
+        for cut in range(len(pending) - 1, checked - 1, -1):
+            if can_split(pending[cut - 1], pending[cut]):
+                yield separator + detokenize(pending[:cut])
+                separator = " "
+                del pending[:cut]
+                break
+    if pending or not separator:
+        yield separator + detokenize(pending)
@@ -0,0 +1,320 @@
+""" Backend di tokenizzazione per `TokenizerModule` (vedi perturbazione/pipeline.py).
+
+- `RegexTokenizer` (default): riproduce `nltk.word_tokenize`, cioè la divisione in frasi con punkt e le regole Treebank, con un'unica espressione regolare compilata e senza dipendere da NLTK.
+- `NltkTokenizer`: chiama direttamente `nltk.word_tokenize` ed è l'implementazione di riferimento.
+
+La concordanza fra i due backend si misura con `perturbazione/tokenizer_agreement.py`.
+"""
+import re
+
+# Caratteri che le regole Treebank separano sempre dal resto del testo
+SEPARATORS = "«“‘„»”’;@#$%&‒-―?!*\\[\\](){}<>"
+
+TOKEN_RE = re.compile(
+    r"(?P<word>(?:[^\s." + SEPARATORS + r"`\":,'-]|\.(?!\.)|[:,](?=\d)|(?<!\.)'(?!')|-(?!-))+)"
+    r"|(?P<punct>[:,])"
+    r"|(?P<sep>[" + SEPARATORS + r"])"
+    r"|(?P<quote>\"|'')"
+    r"|(?P<apostrophe>')"
+    r"|(?P<ellipsis>\.{2,})"
+    r"|(?P<dash>--)"
+    r"|(?P<backticks>`+)")
+
+# Caratteri dopo i quali le virgolette `"` diventano di apertura (``)
+OPENERS = " ([{<«“‘„`"
+
+# Regole di punkt (modello inglese usato da `nltk.word_tokenize`)
+NON_WORD = ")\";}]*:@'({[‘’“”«»?!"
+PUNKT_WORD_RE = re.compile(r"""(?:\-{2,}|\.{2,}|(?:\.\s){2,}\.)
+    |(?=[^\(\"\`{\[:;&\#\*@\)}\]\-,])\S+?
+    (?=\s|$|[)\";}\]\*:@\'\({\[‘’“”«»?!]|\-{2,}|\.{2,}|(?:\.\s){2,}\.
+    |,(?=$|\s|[)\";}\]\*:@\'\({\[‘’“”«»?!]|\-{2,}|\.{2,}|(?:\.\s){2,}\.))
+    |\S""", re.VERBOSE)
+REALIGN_RE = re.compile(r"[\"')\]}‘’“”«»]+?(?:\s+|(?=--)|$)", re.MULTILINE)
+INITIAL_RE = re.compile(r"[^\W\d]\.$")
+NUMBER_RE = re.compile(r"-?[\.,]?\d[\d,\.-]*\.?\Z")
+CANDIDATE_RE = re.compile(r"[.?!](?=[" + re.escape(NON_WORD) + r"]|\s+\S)")
+SPACE_RE = re.compile(r"\s")
+NON_SPACE_RE = re.compile(r"\S")
+# Il punto finale di una frase è separato se è seguito solo da questi caratteri
+CLOSERS_TO_END_RE = re.compile(r"[\]\)}>\"'»”’ ]*\s*\Z")
+
+ABBREVIATIONS = frozenset("""
+a.a a.c a.d a.g a.h a.m a.m.e a.s a.t adm ala ariz aug ave b.f b.v bros c
+c.i.t c.o.m.b c.v calif chg cie co col colo conn corp cos ct d d.c d.h d.w dec
+dr e e.f e.h e.l e.m f f.g f.j feb fla fri ft g g.d g.f g.k ga gen h h.c h.f
+h.m i.m.s ill inc j.b j.c j.j j.k j.p j.r jan jr k kan ky l l.a l.f l.p lt ltd
+m m.b.a m.d.c m.j maj messrs mg mich minn mr mrs ms n n.c n.d n.h n.j n.m n.v
+n.y nev nov oct ok okla ore p p.a.m p.m pa ph.d prof r r.a r.h r.i r.j r.k r.t
+rep reps s s.a s.a.y s.c s.g s.p.a s.s sen sep sept sr st sw t t.j tenn tues
+u.k u.n u.s u.s.a u.s.s.r v va vs vt w w.c w.r w.va w.w wash wed wis yr
+""".split())
+
+# Contrazioni inglesi che Treebank divide in due token: parola -> lunghezza della prima parte
+CONTRACTIONS = {
+    "cannot": 3,
+    "d'ye": 1,
+    "gimme": 3,
+    "gonna": 3,
+    "gotta": 3,
+    "lemme": 3,
+    "more'n": 4,
+    "wanna": 3
+}
+CONTRACTION_LENGTHS = frozenset(len(c) for c in CONTRACTIONS)
+# Le stesse contrazioni all'interno di una parola con apostrofi, trattini o punti
+CONTRACTIONS_RE = re.compile(
+    r"(?i)\b(?:(can)(not)|(d)('ye)|(gim)(me)|(gon)(na)|(got)(ta)|(lem)(me)|(more)('n))\b"
+    r"|(?i:\b(wan)(na)\Z)")
+
+LEADING_APOSTROPHE_RE = re.compile(
+    r"(?i)(?<!\w)(\')(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)")
+SHORT_SUFFIXES = ("'s", "'S", "'m", "'M", "'d", "'D")
+LONG_SUFFIXES = ("'ll", "'LL", "'re", "'RE", "'ve", "'VE", "n't", "N'T")
+
+
+def split_contraction(word: str, tokens: list) -> None:
+    """ Aggiunge a `tokens` la parola `word`, divisa se contiene una contrazione inglese """
+    if word.isalnum():
+        cut = len(word) in CONTRACTION_LENGTHS and CONTRACTIONS.get(
+            word.lower())
+        if cut:
+            tokens.append(word[:cut])
+            tokens.append(word[cut:])
+        else:
+            tokens.append(word)
+        return
+    parts = CONTRACTIONS_RE.sub(
+        lambda m: " " + " ".join(g for g in m.groups() if g) + " ", word)
+    tokens.extend(parts.split())
+
+
+def split_word(word: str, final: bool, tokens: list) -> None:
+    """ Aggiunge a `tokens` i token di una parola che contiene apostrofi o termina con un punto
+
+    Args:
+        word(`str`): parola, senza spazi né separatori
+        final(`bool`): se la parola chiude una frase, e quindi il suo punto finale va separato
+        tokens(`list`): lista a cui aggiungere i token
+    """
+    tail = []
+    if final and len(word) > 1 and word[-1] == ".":
+        word = word[:-1]
+        tail.append(".")
+    if "'" in word:
+        pieces = LEADING_APOSTROPHE_RE.sub("' ", word).split(" ")
+        word = pieces.pop()
+        for piece in pieces:
+            if len(piece) > 1 and piece[-2] != "'":
+                split_contraction(piece[:-1], tokens)
+                piece = "'"
+            split_contraction(piece, tokens)
+        suffixes = []
+        if len(word) > 1 and word[-1] == "'" and word[-2] != "'":
+            word = word[:-1]
+            suffixes.append("'")
+        elif word.endswith(SHORT_SUFFIXES) and len(word) > 2 and word[-3] != "'":
+            suffixes.append(word[-2:])
+            word = word[:-2]
+        if word.endswith(LONG_SUFFIXES) and len(word) > 3 and word[-4] != "'":
+            suffixes.append(word[-3:])
+            word = word[:-3]
+        tail[:0] = reversed(suffixes)
+    if word:
+        split_contraction(word, tokens)
+    tokens.extend(tail)
+
+
+class RegexTokenizer:
+    """ Tokenizzatore veloce che approssima `nltk.word_tokenize` con un'unica scansione del testo.
+    Le regole di divisione in frasi di punkt sono applicate solo alle parole che terminano con un punto e ai punti interrogativi ed esclamativi """
+    name = "regex"
+
+    def __init__(self, abbreviations=ABBREVIATIONS) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            abbreviations(`iterable(str)`, optional): abbreviazioni (minuscole e senza punto finale) dopo le quali non finisce una frase. Di default sono quelle del modello inglese di punkt
+        """
+        self.abbreviations = frozenset(abbreviations)
+
+    def is_break(self, word: str, next_token: str) -> bool:
+        """ Decide, come punkt, se dopo `word` (che termina con un punto) finisce una frase
+
+        Args:
+            word(`str`): token di punkt che termina con il punto
+            next_token(`str`): token di punkt successivo
+        """
+        if word == ".":
+            return True
+        typ = word[:-1].lower()
+        if typ in self.abbreviations or typ.split("-")[-1] in self.abbreviations:
+            return False
+        initial = INITIAL_RE.match(word)
+        if initial or NUMBER_RE.match(word):
+            if next_token in ";:,.!?" and len(next_token) == 1:
+                return False
+            if next_token[0].islower():
+                return False
+            if initial and next_token[0].isupper():
+                return False
+        return True
+
+    def boundary(self, text: str, start: int, end: int):
+        """ Analizza il possibile confine di frase dopo il segno di punteggiatura che termina in `end`.
+        Ritorna una coppia (il segno chiude una frase, posizione in cui inizia la frase successiva oppure None)
+
+        Args:
+            text(`str`): testo da tokenizzare
+            start(`int`): inizio della parola che termina con il segno
+            end(`int`): posizione successiva al segno
+        """
+        if CLOSERS_TO_END_RE.match(text, end):
+            rest = text[end:]
+            return ' "' not in rest and " ''" not in rest, None
+        char = text[end]
+        if char in NON_WORD:
+            next_start = end
+        elif char.isspace():
+            next_start = NON_SPACE_RE.search(text, end).start()
+        else:
+            return False, None
+        # punkt considera solo l'ultimo possibile confine di ogni parola
+        if end > 1 and not text[end - 2].isspace():
+            space = SPACE_RE.search(text, end)
+            candidate = CANDIDATE_RE.search(text, end)
+            if candidate and (space is None
+                              or candidate.start() < space.start()):
+                return False, None
+        if text[end - 1] == ".":
+            # punkt divide in token la parola a partire dall'ultimo spazio
+            while start and not text[start - 1].isspace():
+                start -= 1
+            word = PUNKT_WORD_RE.findall(text, start, end)[-1]
+            if next_start == end:
+                next_token = char
+            else:
+                next_token = PUNKT_WORD_RE.match(text, next_start).group()
+            if not self.is_break(word, next_token):
+                return False, None
+        realigned = REALIGN_RE.match(text, next_start)
+        if not realigned:
+            return True, next_start
+        closers = realigned.group()
+        final = (text[end:next_start].strip(" ") == ""
+                 and not (closers.startswith(('"', "''"))
+                          and text[next_start - 1] == " ")
+                 and not any(c in "‘“«" for c in closers))
+        return final, realigned.end()
+
+    def tokenize(self, text: str) -> list:
+        """ Divide `text` in token
+
+        Args:
+            text(`str`): testo da tokenizzare
+        """
+        tokens = []
+        append = tokens.append
+        sentence_start = 0
+        # Treebank separa una virgola (o i due punti) insieme al carattere successivo:
+        # se questo è a sua volta una virgola, resta attaccato alla parola che segue
+        glued = -1
+        pending = ""
+        for match in TOKEN_RE.finditer(text):
+            kind = match.lastgroup
+            token = match.group()
+            if pending:
+                if kind == "word" and match.start() == glued + 1:
+                    token = pending + token
+                else:
+                    append(pending)
+                pending = ""
+            if kind == "word":
+                if token[-1] == ".":
+                    final, next_start = self.boundary(text, match.start(),
+                                                      match.end())
+                    if next_start is not None:
+                        sentence_start = next_start
+                    split_word(token, final, tokens)
+                elif "'" in token:
+                    split_word(token, False, tokens)
+                else:
+                    split_contraction(token, tokens)
+            elif kind == "punct":
+                start = match.start()
+                if start == glued:
+                    pending = token
+                else:
+                    append(token)
+                    if text[start + 1:start + 2] in (":", ","):
+                        glued = start + 1
+            elif kind == "quote":
+                start = match.start()
+                if (token == '"' and start == sentence_start) or (
+                        start and text[start - 1] in OPENERS):
+                    append("``")
+                else:
+                    append("''")
+            elif kind == "backticks":
+                tokens.extend(["``"] * (len(token) // 2))
+                if len(token) % 2:
+                    append("`")
+            else:
+                if token == "?" or token == "!":
+                    _, next_start = self.boundary(text, match.start(),
+                                                  match.end())
+                    if next_start is not None:
+                        sentence_start = next_start
+                append(token)
+        if pending:
+            append(pending)
+        return tokens
+
+
+class NltkTokenizer:
+    """ Tokenizzatore di riferimento: `nltk.word_tokenize`. Richiede NLTK e il modello punkt """
+    name = "nltk"
+    _checked = False
+
+    def __init__(self) -> None:
+        self.ensure_punkt()
+        from nltk import word_tokenize
+        self.word_tokenize = word_tokenize
+
+    @classmethod
+    def ensure_punkt(cls) -> None:
+        """ Verifica, una sola volta e senza accedere alla rete, che il modello punkt usato da `word_tokenize` sia installato """
+        if cls._checked:
+            return
+        import nltk
+        for resource in ("tokenizers/punkt_tab", "tokenizers/punkt"):
+            try:
+                nltk.data.find(resource)
+                break
+            except LookupError:
+                continue
+        else:
+            raise LookupError(
+                "Il modello punkt di NLTK non è installato. Installarlo una volta con: python -m nltk.downloader punkt_tab punkt"
+            )
+        cls._checked = True
+
+    def tokenize(self, text: str) -> list:
+        """ Divide `text` in token con `nltk.word_tokenize`
+
+        Args:
+            text(`str`): testo da tokenizzare
+        """
+        return self.word_tokenize(text)
+
+
+TOKENIZERS = {"regex": RegexTokenizer, "nltk": NltkTokenizer}
+
+
+def get_tokenizer(name: str):
+    """ Ritorna un'istanza del backend di tokenizzazione `name` ("regex" o "nltk") """
+    if name not in TOKENIZERS:
+        raise ValueError(
+            f"Tokenizzatore sconosciuto: {name!r}. Valori ammessi: {sorted(TOKENIZERS)}"
+        )
+    return TOKENIZERS[name]()
@@ -1,6 +1,32 @@
 # Tutti gli usi di random sono incapsulati in questo file
 # nel caso ci fosse la necessità di cambiare fonte randmom
 import random
+import hashlib
+import math
+from bisect import bisect_right
+from contextlib import contextmanager
+from itertools import accumulate
+
+
+def set_seed(value):
+    random.seed(value)
+
+
+@contextmanager
+def seeded(value):
+    """ Esegue il blocco `with` con la sorgente random inizializzata a `value`, ripristinando alla fine lo stato precedente """
+    state = random.getstate()
+    random.seed(value)
+    try:
+        yield
+    finally:
+        random.setstate(state)
+
+
+def derive_seed(*parts) -> int:
+    """ Deriva un seed intero stabile (indipendente dal processo e da PYTHONHASHSEED) dalle parti fornite """
+    key = "\x1f".join(str(p) for p in parts).encode("utf-8")
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big")
 
 
 # Return True with a probability of prob
@@ -8,6 +34,23 @@ def probability_boolean(prob):
     return random.random() < prob
 
 
+def bernoulli_hits(n, prob):
+    """ Generatore degli indici di range(n) estratti, ognuno con probabilità `prob` (come n chiamate a `probability_boolean`).
+    Invece di estrarre un numero per ogni indice, salta direttamente all'indice estratto successivo con un salto geometrico """
+    if prob <= 0:
+        return
+    if prob >= 1:
+        yield from range(n)
+        return
+    log_q = math.log1p(-prob)
+    i = -1
+    while True:
+        i += 1 + int(math.log(1.0 - random.random()) / log_q)
+        if i >= n:
+            return
+        yield i
+
+
 # Trova tuttle le sottosequenze di una sub-stringa in un'altra stringa
 
 
@@ -33,19 +76,47 @@ def random_choice(lst):
     return random.choice(lst)
 
 
+class WeightedSampler:
+    """ Estrattore pesato: i pesi di un dizionario sono compilati una volta sola in un array cumulativo, così ogni estrazione costa O(log n) """
+    def __init__(self, choice_dict: dict) -> None:
+        """ Costruttore base della classe
+
+        Args:
+            choice_dict(`dict`): dizionario dove ogni chiave è associata ad un peso
+        """
+        self.choices = list(choice_dict.keys())
+        self.cumulative = list(accumulate(choice_dict.values()))
+        self.total = self.cumulative[-1] if len(self.cumulative) else 0
+
+    @classmethod
+    def from_cumulative(cls, choices: list, cumulative) -> "WeightedSampler":
+        """ Crea un estrattore da pesi già cumulati, ad esempio un array in sola lettura condiviso fra più processi
+
+        Args:
+            choices(`list`): chiavi fra cui estrarre
+            cumulative: sequenza dei pesi cumulati, una per chiave
+        """
+        sampler = cls.__new__(cls)
+        sampler.choices = choices
+        sampler.cumulative = cumulative
+        sampler.total = cumulative[-1] if len(cumulative) else 0
+        return sampler
+
+    def sample(self):
+        """ Estrae una chiave con probabilità proporzionale al suo peso """
+        if isinstance(self.total, int):
+            randNumber = random.randrange(self.total)
+        else:
+            randNumber = random.random() * self.total
+        return self.choices[bisect_right(self.cumulative, randNumber)]
+
+
 def weighted_choice(choice_dict):
-    # L'input è un dizionario dove ogni chiave è associata ad un peso intero
-    min = 0
-    max = sum(choice_dict.values())
-    randNumber = randint(min, max)
-    choice = None
-    keys = iter(list(choice_dict.keys()))
-    while choice == None:
-        current = next(keys)
-        randNumber -= choice_dict[current]
-        if (randNumber <= 0):
-            choice = current
-    return current
+    # L'input è un dizionario dove ogni chiave è associata ad un peso intero,
+    # oppure un WeightedSampler già compilato
+    if not isinstance(choice_dict, WeightedSampler):
+        choice_dict = WeightedSampler(choice_dict)
+    return choice_dict.sample()
 
 
 def find_all(a_str: str, sub: str) -> int: